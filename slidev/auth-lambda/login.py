@@ -1,23 +1,47 @@
 import base64
+import gzip
+import hashlib
+import json
 import os
+import re
 import secrets
 import time
 from urllib.parse import parse_qs
 
 import bcrypt
 import boto3
+from botocore.exceptions import ClientError
 
-dynamodb = boto3.resource("dynamodb")
-session_table = dynamodb.Table(os.environ["SESSION_TABLE_NAME"])
+import metrics
 
-# Secrets Manager からパスワードハッシュを取得（Lambda初期化時に1回だけ）
-_sm = boto3.client("secretsmanager")
-_secret = _sm.get_secret_value(SecretId=os.environ["SECRET_ARN"])
-PASSWORD_HASH = _secret["SecretString"].encode("utf-8")
+SESSION_TABLE_NAME = os.environ["SESSION_TABLE_NAME"]
+
+# クライアントは初回利用時に生成する（GET だけのコンテナでは作らない）
+_clients = {}
+_password_hashes = None
+_origin_secret = None
 
 SESSION_TTL_SECONDS = 60 * 60 * 24 * 7  # 1 week
 COOKIE_NAME = "slide_auth"
 
+# bcrypt の前に IP ごとに試行回数を制限する（0 で無効）
+LOGIN_RATE_LIMIT = int(os.environ.get("LOGIN_RATE_LIMIT", "10"))
+LOGIN_RATE_WINDOW_SECONDS = int(os.environ.get("LOGIN_RATE_WINDOW_SECONDS", "300"))
+
+# CloudFront がオリジンに付ける秘密のヘッダーの値（Secrets Manager）。これがあるリクエストだけ
+# CloudFront-Viewer-Address を信用する（execute-api エンドポイントは直接叩けるため）
+ORIGIN_SECRET_ARN = os.environ.get("ORIGIN_SECRET_ARN", "")
+
+# エラーなしのログインページはルームごとに1回だけ描画・gzip してコンテナに保持し、
+# ETag / Cache-Control 付きで返して CloudFront にキャッシュさせる
+LOGIN_PAGE_MAX_AGE = int(os.environ.get("LOGIN_PAGE_MAX_AGE", "300"))
+LOGIN_PAGE_CACHE_SIZE = 256
+_login_pages = {}
+
+# ws-lambda の wscore/connections.py と同じルーム名の規則
+DEFAULT_ROOM = "default"
+ROOM_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
 LOGIN_HTML = """<!DOCTYPE html>
 <html lang="ja">
 <head>
@@ -80,6 +104,7 @@ button:hover {{
 <form class="login-form" method="post" action="/login">
     <h1>Presenter Login</h1>
     {error_html}
+    <input type="hidden" name="room" value="{room}" />
     <input type="password" name="password" placeholder="Password" required autofocus />
     <button type="submit">Login</button>
 </form>
@@ -87,11 +112,104 @@ button:hover {{
 </html>"""
 
 
+def _client(service):
+    if service not in _clients:
+        _clients[service] = metrics.instrument_client(boto3.client(service))
+    return _clients[service]
+
+
+def _get_password_hash(room):
+    # Secrets Manager からパスワードハッシュを取得（最初の POST 時に1回だけ）
+    # 文字列なら全ルーム共通、JSON オブジェクト {"<room>": "<hash>", "*": "<hash>"} ならルームごと
+    global _password_hashes
+    if _password_hashes is None:
+        secret = _client("secretsmanager").get_secret_value(SecretId=os.environ["SECRET_ARN"])
+        value = secret["SecretString"]
+        hashes = json.loads(value) if value.lstrip().startswith("{") else {"*": value}
+        _password_hashes = {name: h.encode("utf-8") for name, h in hashes.items()}
+    return _password_hashes.get(room) or _password_hashes.get("*")
+
+
+def _get_origin_secret():
+    # 最初に必要になったとき1回だけ取得（未設定ならヘッダーを信用しない）
+    global _origin_secret
+    if _origin_secret is None:
+        _origin_secret = ""
+        if ORIGIN_SECRET_ARN:
+            secret = _client("secretsmanager").get_secret_value(SecretId=ORIGIN_SECRET_ARN)
+            _origin_secret = secret["SecretString"]
+    return _origin_secret
+
+
+def _get_client_ip(event):
+    # CloudFront 経由だと sourceIp はエッジの IP になるので、CloudFront-Viewer-Address（"ip:port"）を優先
+    # ただし偽装できるので、秘密のヘッダーで CloudFront 経由と確認できたときだけ
+    headers = event.get("headers") or {}
+    viewer_address = headers.get("cloudfront-viewer-address")
+    if viewer_address and "x-origin-secret" in headers:
+        origin_secret = _get_origin_secret()
+        if origin_secret and secrets.compare_digest(headers["x-origin-secret"], origin_secret):
+            return viewer_address.rsplit(":", 1)[0]
+    return event["requestContext"]["http"]["sourceIp"]
+
+
+def _allow_attempt(ip):
+    # sessions テーブルに IP・時間枠ごとの試行回数を TTL 付きで数え、上限に達したら False
+    if LOGIN_RATE_LIMIT <= 0:
+        return True
+    window = int(time.time()) // LOGIN_RATE_WINDOW_SECONDS
+    try:
+        _client("dynamodb").update_item(
+            TableName=SESSION_TABLE_NAME,
+            Key={"token": {"S": f"ratelimit#{ip}#{window}"}},
+            UpdateExpression="ADD attempts :one SET #ttl = :ttl",
+            ConditionExpression="attribute_not_exists(attempts) OR attempts < :limit",
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={
+                ":one": {"N": "1"},
+                ":limit": {"N": str(LOGIN_RATE_LIMIT)},
+                ":ttl": {"N": str((window + 2) * LOGIN_RATE_WINDOW_SECONDS)},
+            },
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+def _get_room(params):
+    room = params.get("room") or DEFAULT_ROOM
+    return room if ROOM_PATTERN.match(room) else None
+
+
+def _login_page(room):
+    page = _login_pages.get(room)
+    if page is None:
+        if len(_login_pages) >= LOGIN_PAGE_CACHE_SIZE:
+            _login_pages.clear()
+        html = LOGIN_HTML.format(error_html="", room=room).encode("utf-8")
+        page = _login_pages[room] = {
+            "html": html,
+            "gzip": base64.b64encode(gzip.compress(html, mtime=0)).decode("ascii"),
+            "etag": f'"{hashlib.sha256(html).hexdigest()[:32]}"',
+        }
+    return page
+
+
+_login_page(DEFAULT_ROOM)
+
+
+@metrics.instrument("login")
 def handler(event, context):
     method = event["requestContext"]["http"]["method"]
+    metrics.set_route(method if method in ("GET", "POST") else "other")
 
     if method == "GET":
-        return _render_login_page()
+        room = _get_room(event.get("queryStringParameters") or {})
+        if room is None:
+            return {"statusCode": 400, "body": "Invalid room"}
+        return _serve_login_page(event, room)
 
     if method == "POST":
         return _handle_login(event)
@@ -99,12 +217,44 @@ def handler(event, context):
     return {"statusCode": 405, "body": "Method Not Allowed"}
 
 
-def _render_login_page(error=None):
+def _serve_login_page(event, room):
+    page = _login_page(room)
+    request_headers = event.get("headers") or {}
+    headers = {
+        "Content-Type": "text/html; charset=utf-8",
+        "Cache-Control": f"public, max-age={LOGIN_PAGE_MAX_AGE}",
+        "ETag": page["etag"],
+        "Vary": "Accept-Encoding",
+    }
+    if page["etag"] in request_headers.get("if-none-match", ""):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    accepted = {
+        encoding.split(";")[0].strip()
+        for encoding in request_headers.get("accept-encoding", "").split(",")
+    }
+    # br を受け付けるクライアントには無圧縮で返し、CloudFront の compress で br にさせる
+    # （CloudFront は Accept-Encoding を "br,gzip" に正規化して転送する）
+    if "gzip" in accepted and "br" not in accepted:
+        return {
+            "statusCode": 200,
+            "headers": {**headers, "Content-Encoding": "gzip"},
+            "body": page["gzip"],
+            "isBase64Encoded": True,
+        }
+    return {"statusCode": 200, "headers": headers, "body": page["html"].decode("utf-8")}
+
+
+def _render_login_page(room, error=None, status_code=200, headers=None):
+    # エラー付きのページは POST の結果なので毎回描画し、キャッシュさせない
     error_html = f'<p class="error">{error}</p>' if error else ""
-    html = LOGIN_HTML.format(error_html=error_html)
+    html = LOGIN_HTML.format(error_html=error_html, room=room)
     return {
-        "statusCode": 200,
-        "headers": {"Content-Type": "text/html; charset=utf-8"},
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "text/html; charset=utf-8",
+            "Cache-Control": "no-store",
+            **(headers or {}),
+        },
         "body": html,
     }
 
@@ -116,22 +266,41 @@ def _handle_login(event):
 
     params = parse_qs(body)
     password = params.get("password", [None])[0]
+    room = _get_room({"room": params.get("room", [None])[0]})
+    if room is None:
+        return {"statusCode": 400, "body": "Invalid room"}
 
     if not password:
-        return _render_login_page(error="Password is required")
+        return _render_login_page(room, error="Password is required")
+
+    if not _allow_attempt(_get_client_ip(event)):
+        metrics.add("LoginRateLimited", 1)
+        return _render_login_page(
+            room,
+            error="Too many attempts. Try again later.",
+            status_code=429,
+            headers={"Retry-After": str(LOGIN_RATE_WINDOW_SECONDS)},
+        )
 
-    if not bcrypt.checkpw(password.encode("utf-8"), PASSWORD_HASH):
-        return _render_login_page(error="Invalid password")
+    password_hash = _get_password_hash(room)
+    started = time.perf_counter()
+    valid = password_hash is not None and bcrypt.checkpw(password.encode("utf-8"), password_hash)
+    metrics.add("CheckpwMs", round((time.perf_counter() - started) * 1000, 1), "Milliseconds")
+    if not valid:
+        metrics.add("LoginFailures", 1)
+        return _render_login_page(room, error="Invalid password")
 
     token = secrets.token_hex(32)
     ttl = int(time.time()) + SESSION_TTL_SECONDS
 
-    session_table.put_item(
+    _client("dynamodb").put_item(
+        TableName=SESSION_TABLE_NAME,
         Item={
-            "token": token,
-            "status": "valid",
-            "ttl": ttl,
-        }
+            "token": {"S": token},
+            "status": {"S": "valid"},
+            "room": {"S": room},
+            "ttl": {"N": str(ttl)},
+        },
     )
 
     cookie = (
@@ -144,7 +313,7 @@ def _handle_login(event):
     return {
         "statusCode": 302,
         "headers": {
-            "Location": "/presenter/1",
+            "Location": "/presenter/1" if room == DEFAULT_ROOM else f"/presenter/1?room={room}",
             "Set-Cookie": cookie,
         },
         "body": "",
@@ -0,0 +1 @@
+../ws-lambda/wscore/metrics.py
\ No newline at end of file
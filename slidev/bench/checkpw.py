@@ -0,0 +1,101 @@
+"""bcrypt.checkpw latency by hash cost, locally or on the login Lambda per memory size.
+
+checkpw is pure CPU, and Lambda hands out CPU in proportion to memory (one
+full vCPU at 1769 MB), so the cost factor in the stored hash and the
+function's memory_size have to be picked together.
+
+Locally, each cost factor is timed on this machine:
+
+    python slidev/bench/checkpw.py [--costs 10 11 12] [--iterations 5]
+
+With --function, the deployed login Lambda is switched through each memory
+size and sent wrong-password POSTs; the Duration from each invocation's log
+tail is reported, and the original memory size is restored afterwards.
+This changes the live function while it runs, so only use it on a
+deployment nobody is logging in to:
+
+    python slidev/bench/checkpw.py --function slidev-hosting-login \\
+        [--memory 512 1024 1769 3008] [--iterations 5]
+"""
+
+import argparse
+import base64
+import json
+import re
+import statistics
+import time
+
+DURATION = re.compile(r"\tDuration: ([\d.]+) ms")
+
+
+def _local(costs, iterations):
+    import bcrypt
+
+    print(f"{'cost':>4} {'median ms':>10} {'max ms':>8}")
+    for cost in costs:
+        hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(rounds=cost))
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            bcrypt.checkpw(b"wrong password", hashed)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{cost:>4} {statistics.median(samples):>10.1f} {max(samples):>8.1f}")
+
+
+def _login_event(attempt):
+    # A distinct documentation-range address per attempt keeps the rate limiter out of the way
+    return {
+        "requestContext": {"http": {"method": "POST", "sourceIp": f"198.51.100.{attempt % 256}"}},
+        "headers": {},
+        "body": "password=wrong-password&room=default",
+        "isBase64Encoded": False,
+    }
+
+
+def _lambda(function_name, memory_sizes, iterations):
+    import boto3
+
+    client = boto3.client("lambda")
+    original = client.get_function_configuration(FunctionName=function_name)["MemorySize"]
+    waiter = client.get_waiter("function_updated_v2")
+    attempt = 0
+    print(f"{'memory MB':>9} {'median ms':>10} {'max ms':>8}")
+    try:
+        for memory in memory_sizes:
+            client.update_function_configuration(FunctionName=function_name, MemorySize=memory)
+            waiter.wait(FunctionName=function_name)
+            samples = []
+            # The first invocation after a configuration change is a cold start
+            for _ in range(iterations + 1):
+                attempt += 1
+                resp = client.invoke(
+                    FunctionName=function_name,
+                    Payload=json.dumps(_login_event(attempt)),
+                    LogType="Tail",
+                )
+                log = base64.b64decode(resp["LogResult"]).decode("utf-8")
+                match = DURATION.search(log)
+                if match:
+                    samples.append(float(match.group(1)))
+            samples = samples[1:]
+            print(f"{memory:>9} {statistics.median(samples):>10.1f} {max(samples):>8.1f}")
+    finally:
+        client.update_function_configuration(FunctionName=function_name, MemorySize=original)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--costs", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--function")
+    parser.add_argument("--memory", type=int, nargs="+", default=[512, 1024, 1769, 3008])
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.function:
+        _lambda(args.function, args.memory, args.iterations)
+    else:
+        _local(args.costs, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Per-invocation cost of building management API clients.
+
+Before wscore, every broadcast() and viewer_count reply built a fresh
+apigatewaymanagementapi client. This measures that construction against the
+cached lookup in wscore.aws.get_apigw_client. No AWS calls are made.
+
+    python slidev/bench/client_construction.py [--iterations 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "ap-northeast-1")
+for name in ("CONNECTIONS_TABLE_NAME", "SESSION_TABLE_NAME", "POLL_TABLE_NAME"):
+    os.environ.setdefault(name, "bench")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ws-lambda"))
+
+import boto3  # noqa: E402
+
+from wscore.aws import get_apigw_client  # noqa: E402
+
+EVENT = {"requestContext": {"domainName": "example.execute-api.ap-northeast-1.amazonaws.com", "stage": "ws"}}
+ENDPOINT = "https://example.execute-api.ap-northeast-1.amazonaws.com/ws"
+
+
+def _time(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{label:<34} mean {statistics.mean(samples):8.3f} ms   "
+          f"p50 {statistics.median(samples):8.3f} ms   p99 {p99:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    # The first client in a process also loads the service model from disk
+    first = _time(lambda: boto3.client("apigatewaymanagementapi", endpoint_url=ENDPOINT), 1)
+    fresh = _time(
+        lambda: boto3.client("apigatewaymanagementapi", endpoint_url=ENDPOINT),
+        args.iterations,
+    )
+    get_apigw_client(EVENT)
+    cached = _time(lambda: get_apigw_client(EVENT), args.iterations)
+
+    print(f"first client in process (cold start): {first[0]:.3f} ms")
+    _report("fresh client per call (before)", fresh)
+    _report("cached per endpoint (wscore)", cached)
+    saved = statistics.mean(fresh) - statistics.mean(cached)
+    print(f"saved per broadcast/reply: {saved:.3f} ms; a poll vote used to build 1, "
+          f"a viewer_count request 1, every $connect/$disconnect 1")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Import-time and init-time breakdown for the ws and auth Lambdas.
+
+Each handler is imported in a fresh interpreter under ``python -X importtime``
+and the self time of every module is summed by top-level package. The first-use cost
+of the clients each route builds lazily is measured the same way, so the
+two numbers together approximate a cold start without touching AWS.
+
+    python slidev/bench/cold_start.py [--runs 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+HANDLERS = {
+    "authorizer": (os.path.join(ROOT, "ws-lambda", "authorizer"), "handler"),
+    "connect": (os.path.join(ROOT, "ws-lambda", "connect"), "handler"),
+    "disconnect": (os.path.join(ROOT, "ws-lambda", "disconnect"), "handler"),
+    "message": (os.path.join(ROOT, "ws-lambda", "message"), "handler"),
+    "login": (os.path.join(ROOT, "auth-lambda"), "login"),
+}
+
+# Work deferred from import time to the first request that needs it
+# as (already imported at init, timed on first use)
+FIRST_USE = {
+    "dynamodb client (hot paths)": ("import boto3", "boto3.client('dynamodb')"),
+    "dynamodb resource (poll routes)": ("import boto3", "boto3.resource('dynamodb').Table('t')"),
+    "poll modules (first poll message)": ("import handler", "import poll.vote, poll.unvote, poll.switch, poll.get"),
+}
+
+ENV = {
+    **os.environ,
+    "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "ap-northeast-1"),
+    "CONNECTIONS_TABLE_NAME": "bench",
+    "SESSION_TABLE_NAME": "bench",
+    "POLL_TABLE_NAME": "bench",
+    "SECRET_ARN": "bench",
+}
+
+
+def _importtime(cwd, code):
+    """Return {top-level package: self ms} for one fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, env=ENV, capture_output=True, text=True, check=True,
+    )
+    totals = defaultdict(float)
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        if package in sys.stdlib_module_names:
+            package = "stdlib"
+        totals[package] += int(self_us) / 1000
+    return totals
+
+
+def _wall(cwd, code, runs, setup="pass"):
+    timer = (
+        setup + "; import time; t = time.perf_counter(); " + code +
+        "; print((time.perf_counter() - t) * 1000)"
+    )
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-c", timer],
+            cwd=cwd, env=ENV, capture_output=True, text=True, check=True,
+        )
+        samples.append(float(proc.stdout.strip().splitlines()[-1]))
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print("== import time (median of runs, ms)")
+    for name, (cwd, module) in HANDLERS.items():
+        runs = [_importtime(cwd, f"import {module}") for _ in range(args.runs)]
+        packages = sorted({pkg for run in runs for pkg in run})
+        breakdown = {pkg: statistics.median(run.get(pkg, 0.0) for run in runs) for pkg in packages}
+        total = _wall(cwd, f"import {module}", args.runs)
+        top = sorted(breakdown.items(), key=lambda kv: kv[1], reverse=True)[:6]
+        print(f"{name:<11} total {total:7.1f}   " +
+              "  ".join(f"{pkg} {ms:.1f}" for pkg, ms in top))
+
+    print("== first-use init (median of runs, ms)")
+    message_dir = HANDLERS["message"][0]
+    for label, (setup, code) in FIRST_USE.items():
+        print(f"{label:<36} {_wall(message_dir, code, args.runs, setup):7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""Load test for the ws Lambdas, run in-process against moto.
+
+The connect, disconnect and message handlers are imported as they are
+deployed and invoked from a thread pool, which stands in for concurrent
+Lambda invocations. Like Lambda, each invocation runs in a warm container
+that is running nothing else: --containers (default: --concurrency) sets of
+the handler modules are loaded, each with its own module-level caches, and
+an invocation waits for an idle one. The asynchronous self-invocations the
+connect handler makes are run as invocations too. DynamoDB is moto's
+in-memory mock. The management API is a fake with a configurable per-call
+latency and GoneException rate. Each scenario reports throughput, handler
+latency percentiles, DynamoDB calls per invocation and a projected AWS bill.
+
+DynamoDB calls are serialized (moto is not thread-safe), so contention
+between concurrent writes is not modeled: a vote burst reports no
+TransactionConflict retries or failures even where the real table would
+have them.
+
+    pip install "moto[dynamodb]"
+    python slidev/bench/load_test.py [--scenario join vote flip blip] [--viewers 500]
+        [--concurrency 50] [--containers 50] [--latency-ms 20] [--gone-rate 0.01]
+        [--dynamodb-latency-ms 5] [--env VIEWER_COUNT_WINDOW_MS=0 ...]
+
+--env sets handler environment variables (windows, caches, shards) before
+the handlers are imported. Invocations carry the $connect authorizer's
+context, as they do when deployed; --no-authorizer drops it.
+
+The handlers' own per-invocation metrics are off here; add
+--env METRICS_MODE=local --logs to see them.
+"""
+
+import argparse
+import builtins
+import contextlib
+import importlib.machinery
+import importlib.util
+import json
+import os
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+WS_LAMBDA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ws-lambda")
+DOMAIN = "bench.example"
+STAGE = "ws"
+
+# ap-northeast-1 on-demand list prices in USD; check them before quoting results
+PRICES = {
+    "dynamodb_write_unit": 0.715 / 1e6,
+    "dynamodb_read_unit": 0.1425 / 1e6,
+    "websocket_message": 1.14 / 1e6,
+    "lambda_request": 0.20 / 1e6,
+    "lambda_gb_second": 0.0000166667,
+}
+LAMBDA_MEMORY_GB = 128 / 1024  # the ws Lambdas run with the default memory size
+
+READ_OPERATIONS = {"GetItem", "Query", "Scan"}
+
+# Top-level modules the handlers import from their own directories; every
+# container gets its own copies
+HANDLER_MODULES = {"wscore", "poll", "slide_sync", "viewer_count", "resume_token"}
+# Imported by the message handler on first use; loaded up front so they
+# belong to the container too
+LAZY_MODULES = ["poll.vote", "poll.unvote", "poll.switch", "poll.get", "poll.get_many"]
+CONNECT_FUNCTION_NAME = "bench-ws-connect"
+
+
+class FakeManagementApi:
+    """post_to_connection with a fixed latency.
+
+    Each connection is gone with probability gone_rate, decided on its
+    first post; gone connections answer GoneException from then on.
+    """
+
+    def __init__(self, latency_ms, gone_rate, seed):
+        from botocore.exceptions import ClientError
+
+        self._client_error = ClientError
+        self._latency = latency_ms / 1000
+        self._gone_rate = gone_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._gone = {}
+        self.posts = 0
+
+    def post_to_connection(self, ConnectionId, Data):
+        time.sleep(self._latency)
+        with self._lock:
+            self.posts += 1
+            gone = self._gone.get(ConnectionId)
+            if gone is None:
+                gone = self._gone[ConnectionId] = self._random.random() < self._gone_rate
+        if gone:
+            raise self._client_error(
+                {"Error": {"Code": "GoneException", "Message": "Gone"}}, "PostToConnection"
+            )
+
+
+class FakeLambda:
+    """Lambda client that keeps asynchronous invocations for the bench to run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        handler = FunctionName.rsplit("-", 1)[1]
+        with self._lock:
+            self._pending.append((handler, json.loads(Payload)))
+        return {"StatusCode": 202}
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+
+class DynamoDBMeter:
+    """Counts DynamoDB calls and the request units they cost, assuming items under 1 KB.
+
+    moto's backends are not thread-safe (concurrent transactions corrupt
+    them), so calls into it are serialized; latency_ms is slept outside the
+    lock to stand in for the real round trip. Serialized calls never
+    overlap, so write contention (TransactionConflict on a hot META item,
+    throttling on a hot partition) cannot happen here.
+    """
+
+    def __init__(self, latency_ms):
+        self._lock = threading.Lock()
+        self._moto_lock = threading.Lock()
+        self._latency = latency_ms / 1000
+        self.calls = Counter()
+        self.read_units = 0.0
+        self.write_units = 0.0
+
+    def attach(self, client):
+        client.meta.events.register("before-parameter-build.dynamodb", self._count)
+        make_api_call = client._make_api_call
+
+        def serialized(operation_name, api_params):
+            time.sleep(self._latency)
+            with self._moto_lock:
+                return make_api_call(operation_name, api_params)
+
+        client._make_api_call = serialized
+
+    def _count(self, model, params, **kwargs):
+        name = model.name
+        if name == "BatchGetItem":
+            reads = sum(len(request["Keys"]) for request in params["RequestItems"].values())
+            writes = 0
+        elif name == "BatchWriteItem":
+            reads, writes = 0, sum(len(requests) for requests in params["RequestItems"].values())
+        elif name == "TransactWriteItems":
+            reads, writes = 0, 2 * len(params["TransactItems"])
+        elif name in READ_OPERATIONS:
+            reads = 0.5 if not params.get("ConsistentRead") else 1
+            writes = 0
+        else:
+            reads, writes = 0, 1
+        with self._lock:
+            self.calls[name] += 1
+            self.read_units += reads
+            self.write_units += writes
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.read_units = self.write_units = 0.0
+
+
+def _is_handler_module(name):
+    return name.split(".")[0] in HANDLER_MODULES
+
+
+class _ContainerLoader(importlib.machinery.SourceFileLoader):
+    """Runs a module with its container's builtins, so its imports go through the container."""
+
+    def __init__(self, fullname, path, container_builtins):
+        super().__init__(fullname, path)
+        self._builtins = container_builtins
+
+    def exec_module(self, module):
+        module.__builtins__ = self._builtins
+        super().exec_module(module)
+
+
+class _ContainerFinder:
+    def __init__(self, container_builtins):
+        self._builtins = container_builtins
+
+    def find_spec(self, name, path=None, target=None):
+        if not _is_handler_module(name):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        if spec is not None and isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            spec.loader = _ContainerLoader(name, spec.origin, self._builtins)
+        return spec
+
+
+class Container:
+    """One warm Lambda container: its own copy of the handlers and every module they import.
+
+    Imports that run at call time (the message handler's poll modules)
+    would find whichever copy sys.modules holds last, so the container's
+    modules are executed with an __import__ that looks in the container's
+    own set first.
+    """
+
+    def __init__(self):
+        for name in [m for m in sys.modules if _is_handler_module(m)]:
+            del sys.modules[name]
+        self.modules = {}
+        container_builtins = {**vars(builtins), "__import__": self._import}
+        finder = _ContainerFinder(container_builtins)
+        sys.meta_path.insert(0, finder)
+        try:
+            self.connect = self._load_handler("connect", container_builtins)
+            self.disconnect = self._load_handler("disconnect", container_builtins)
+            self.message = self._load_handler("message", container_builtins)
+            for name in LAZY_MODULES:
+                importlib.import_module(name)
+        finally:
+            sys.meta_path.remove(finder)
+        self.modules = {name: module for name, module in sys.modules.items() if _is_handler_module(name)}
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in self.modules:
+            return self.modules[name] if fromlist else self.modules[name.split(".")[0]]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    @staticmethod
+    def _load_handler(name, container_builtins):
+        spec = importlib.util.spec_from_file_location(
+            f"{name}_handler", os.path.join(WS_LAMBDA, name, "handler.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        module.__builtins__ = container_builtins
+        spec.loader.exec_module(module)
+        return module.handler
+
+
+def _create_tables():
+    import boto3
+
+    client = boto3.client("dynamodb")
+    for name, hash_key, range_key in [
+        (os.environ["CONNECTIONS_TABLE_NAME"], "room", "connectionId"),
+        (os.environ["POLL_TABLE_NAME"], "pollId", "connectionId"),
+    ]:
+        client.create_table(
+            TableName=name,
+            BillingMode="PAY_PER_REQUEST",
+            AttributeDefinitions=[
+                {"AttributeName": hash_key, "AttributeType": "S"},
+                {"AttributeName": range_key, "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": hash_key, "KeyType": "HASH"},
+                {"AttributeName": range_key, "KeyType": "RANGE"},
+            ],
+        )
+    client.create_table(
+        TableName=os.environ["SESSION_TABLE_NAME"],
+        BillingMode="PAY_PER_REQUEST",
+        AttributeDefinitions=[{"AttributeName": "token", "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": "token", "KeyType": "HASH"}],
+    )
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.api = FakeManagementApi(args.latency_ms, args.gone_rate, args.seed)
+        self.functions = FakeLambda()
+        self.meter = DynamoDBMeter(args.dynamodb_latency_ms)
+        self.idle = queue.Queue()
+        for _ in range(args.containers or args.concurrency):
+            container = Container()
+            aws = container.modules["wscore.aws"]
+            aws._apigw_client_cache[f"https://{DOMAIN}/{STAGE}"] = self.api
+            aws._lambda_client = self.functions
+            self.meter.attach(aws.dynamodb_client())
+            self.meter.attach(aws.poll_table.meta.client)
+            self.idle.put(container)
+
+    def invoke(self, handler, event):
+        """Run one invocation on an idle container."""
+        container = self.idle.get()
+        try:
+            return getattr(container, handler)(event, None)
+        finally:
+            self.idle.put(container)
+
+    def event(self, connection_id, role="viewer", body=None):
+        request_context = {"connectionId": connection_id, "domainName": DOMAIN, "stage": STAGE}
+        if not self.args.no_authorizer:
+            request_context["authorizer"] = {"role": role, "room": "default"}
+        event = {"requestContext": request_context, "queryStringParameters": {"v": "3"}}
+        if body is not None:
+            event["body"] = json.dumps(body)
+        return event
+
+    def logs(self):
+        """The handlers' JSON log lines are dropped unless --logs is given."""
+        if self.args.logs:
+            return contextlib.nullcontext()
+        return contextlib.redirect_stdout(open(os.devnull, "w"))
+
+    def setup(self, handler, event):
+        with self.logs():
+            self.invoke(handler, event)
+            for pending in self.functions.take():
+                self.invoke(*pending)
+
+    def run(self, label, handler, events):
+        """Invoke handler once per event on the pool and print the scenario report.
+
+        handler names the function to invoke, or picks it for each event.
+        Asynchronous invocations the handlers make are run afterwards, until
+        none are left.
+        """
+        self.meter.reset()
+        posts_before = self.api.posts
+        durations = []
+        errors = Counter()
+
+        def invoke(pending):
+            handler, event = pending
+            started = time.perf_counter()
+            try:
+                self.invoke(handler, event)
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                errors[f"{type(e).__name__}:{code}" if code else type(e).__name__] += 1
+            durations.append(time.perf_counter() - started)
+
+        pending = [(handler if isinstance(handler, str) else handler(event), event) for event in events]
+        asynchronous = 0
+        started = time.perf_counter()
+        with self.logs(), ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            while pending:
+                list(pool.map(invoke, pending))
+                pending = self.functions.take()
+                asynchronous += len(pending)
+        wall = time.perf_counter() - started
+        self.report(label, durations, wall, self.api.posts - posts_before, errors, asynchronous)
+
+    def report(self, label, durations, wall, posts, errors, asynchronous=0):
+        meter = self.meter
+        invocations = len(durations)
+        durations = sorted(durations)
+        costs = {
+            "dynamodb": meter.read_units * PRICES["dynamodb_read_unit"]
+            + meter.write_units * PRICES["dynamodb_write_unit"],
+            "websocket": (invocations + posts) * PRICES["websocket_message"],
+            "lambda": invocations * PRICES["lambda_request"]
+            + sum(durations) * LAMBDA_MEMORY_GB * PRICES["lambda_gb_second"],
+        }
+        print(f"== {label}")
+        print(f"  invocations {invocations} ({asynchronous} async)  wall {wall:.2f}s  {invocations / wall:.0f}/s  "
+              f"errors {dict(errors) or 0}")
+        print("  latency ms  " + "  ".join(
+            f"p{int(q * 100)} {statistics.quantiles(durations, n=100)[int(q * 100) - 1] * 1000:.0f}"
+            if len(durations) > 1 else f"p{int(q * 100)} {durations[0] * 1000:.0f}"
+            for q in (0.5, 0.9, 0.99)
+        ))
+        print(f"  posts {posts}  ({posts / invocations:.1f} per invocation)")
+        print(f"  dynamodb calls per invocation {sum(meter.calls.values()) / invocations:.2f}  " +
+              "  ".join(f"{name} {count}" for name, count in meter.calls.most_common()))
+        print(f"  projected cost ${sum(costs.values()):.6f}  " +
+              "  ".join(f"{name} ${cost:.6f}" for name, cost in costs.items()))
+
+    def connect_viewers(self, count, label="join storm"):
+        self.run(
+            f"{label}: {count} viewers",
+            "connect",
+            [self.event(f"viewer-{i}") for i in range(count)],
+        )
+
+    def scenario_join(self):
+        self.connect_viewers(self.args.viewers)
+        self.run(
+            f"leave storm: {self.args.viewers} viewers",
+            "disconnect",
+            [self.event(f"viewer-{i}") for i in range(self.args.viewers)],
+        )
+
+    def scenario_vote(self):
+        presenter = self.event("presenter", role="presenter")
+        self.setup("connect", presenter)
+        self.connect_viewers(self.args.viewers, "setup")
+        options = ["a", "b", "c", "d"]
+        self.setup("message", self.event("presenter", "presenter", {
+            "type": "poll_get", "pollId": "bench", "visitorId": "presenter",
+            "options": options, "maxChoices": 1,
+        }))
+        self.run(
+            f"vote burst: {self.args.viewers} votes (DynamoDB write contention not modeled)",
+            "message",
+            [
+                self.event(f"viewer-{i}", body={
+                    "type": "poll_vote", "pollId": "bench",
+                    "visitorId": f"visitor-{i}", "choice": random.choice(options),
+                })
+                for i in range(self.args.viewers)
+            ],
+        )
+
+    def scenario_flip(self):
+        self.setup("connect", self.event("presenter", role="presenter"))
+        self.connect_viewers(self.args.viewers, "setup")
+        self.run(
+            f"slide flipping: {self.args.flips} syncs to {self.args.viewers} viewers",
+            "message",
+            [
+                self.event("presenter", "presenter", {"page": page, "clicks": 0})
+                for page in range(1, self.args.flips + 1)
+            ],
+        )
+
+    def scenario_blip(self):
+        from wscore.connections import get_resume_token
+
+        self.connect_viewers(self.args.viewers, "setup")
+        events = []
+        for i in range(self.args.viewers):
+            token, _ = get_resume_token(f"viewer-{i}")
+            resumed = self.event(f"viewer-{i}-resumed")
+            resumed["queryStringParameters"]["resume"] = token
+            events += [self.event(f"viewer-{i}"), resumed]
+        self.run(
+            f"wi-fi blip: {self.args.viewers} viewers disconnect and resume",
+            lambda event: "connect" if "resume" in event["queryStringParameters"] else "disconnect",
+            events,
+        )
+
+
+SCENARIOS = {
+    "join": "scenario_join",
+    "vote": "scenario_vote",
+    "flip": "scenario_flip",
+    "blip": "scenario_blip",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--viewers", type=int, default=500)
+    parser.add_argument("--flips", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--containers", type=int, help="warm containers (default: --concurrency)")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--gone-rate", type=float, default=0.01)
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--no-authorizer", action="store_true")
+    parser.add_argument("--logs", action="store_true", help="keep the handlers' log lines")
+    args = parser.parse_args()
+
+    os.environ.update(
+        AWS_DEFAULT_REGION="ap-northeast-1",
+        AWS_ACCESS_KEY_ID="bench",
+        AWS_SECRET_ACCESS_KEY="bench",
+        CONNECTIONS_TABLE_NAME="bench-connections",
+        SESSION_TABLE_NAME="bench-sessions",
+        POLL_TABLE_NAME="bench-polls",
+        METRICS_MODE="off",
+        AWS_LAMBDA_FUNCTION_NAME=CONNECT_FUNCTION_NAME,
+    )
+    os.environ.update(pair.split("=", 1) for pair in args.env)
+    random.seed(args.seed)
+    sys.path.insert(0, WS_LAMBDA)
+    sys.path.insert(0, os.path.join(WS_LAMBDA, "message"))
+
+    from moto import mock_aws
+
+    for name in args.scenario:
+        # Every scenario starts from empty tables and cold containers
+        with mock_aws():
+            _create_tables()
+            getattr(Bench(args), SCENARIOS[name])()
+
+
+if __name__ == "__main__":
+    main()
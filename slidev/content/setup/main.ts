@@ -9,7 +9,41 @@ import {
 } from "./connectionState";
 
 // ロール判定はサーバー側でCookieベースで行う
-const SYNC_SERVER = `${window.location.origin.replace(/^http/, "ws")}/ws`;
+// v=2: 投票数は poll_delta（変更分のみ、seq 付き）で届く
+// v=3: スライド同期は slide_sync（seq 付き）で届き、古い seq は捨てる
+const PROTOCOL_VERSION = 3;
+
+// ルームは ?room= で指定する。スライド遷移でクエリが消えてもタブ内では維持する
+function getRoom(): string {
+	const fromQuery = new URLSearchParams(window.location.search).get("room");
+	if (fromQuery) {
+		sessionStorage.setItem("slide_room", fromQuery);
+		return fromQuery;
+	}
+	return sessionStorage.getItem("slide_room") ?? "default";
+}
+
+const SYNC_SERVER = `${window.location.origin.replace(/^http/, "ws")}/ws?v=${PROTOCOL_VERSION}&room=${encodeURIComponent(getRoom())}`;
+
+// 再接続時は resume トークンで前の接続を引き継ぐ（猶予時間内なら入退室として扱われない）
+interface ResumeToken {
+	token: string;
+	expiresAt: number;
+	room: string;
+}
+
+function getResumeToken(): ResumeToken | null {
+	const stored = sessionStorage.getItem("slide_resume");
+	if (!stored) return null;
+	const resume = JSON.parse(stored) as ResumeToken;
+	const valid = resume.room === getRoom() && resume.expiresAt > Date.now() / 1000 + 60;
+	return valid ? resume : null;
+}
+
+function syncServerUrl(): string {
+	const resume = getResumeToken();
+	return resume ? `${SYNC_SERVER}&resume=${resume.token}` : SYNC_SERVER;
+}
 
 let reconnectTimer: number | null = null;
 
@@ -33,7 +67,48 @@ export function sendWsMessage(data: Record<string, unknown>): boolean {
 	return false;
 }
 
+// 同じタイミングの poll_get（マウント・再接続）は1通の poll_get_many にまとめる
+const POLL_GET_MANY_MAX = 50;
+
+export interface PollStateRequest {
+	pollId: string;
+	options: string[];
+	maxChoices: number;
+}
+
+const pendingPollGets = new Map<string, PollStateRequest>();
+let pendingPollVisitorId: string | null = null;
+let pollGetTimer: number | null = null;
+
+function flushPollGets() {
+	pollGetTimer = null;
+	const polls = [...pendingPollGets.values()];
+	const visitorId = pendingPollVisitorId;
+	pendingPollGets.clear();
+	if (polls.length === 1) {
+		sendWsMessage({ type: "poll_get", visitorId, ...polls[0] });
+		return;
+	}
+	for (let i = 0; i < polls.length; i += POLL_GET_MANY_MAX) {
+		sendWsMessage({
+			type: "poll_get_many",
+			visitorId,
+			polls: polls.slice(i, i + POLL_GET_MANY_MAX),
+		});
+	}
+}
+
+export function requestPollState(visitorId: string, poll: PollStateRequest) {
+	pendingPollVisitorId = visitorId;
+	pendingPollGets.set(poll.pollId, poll);
+	if (pollGetTimer === null) {
+		pollGetTimer = setTimeout(flushPollGets, 0) as unknown as number;
+	}
+}
+
 let connected = false;
+// 最後に反映したスライド同期の seq（ルーム内で単調増加）
+let lastSlideSeq: number | null = null;
 
 export function connectWebSocket(onUpdate: (data: Partial<object>) => void): void {
 	if (connected) return;
@@ -45,20 +120,41 @@ export function connectWebSocket(onUpdate: (data: Partial<object>) => void): voi
 		reconnectTimer = null;
 	}
 
-	const ws = new WebSocket(SYNC_SERVER);
+	const ws = new WebSocket(syncServerUrl());
 	setWsInstance(ws);
 
 	ws.onopen = () => {
 		changeConnectionState(ConnectionStatusEnum.Connected);
+		// 途中参加・再接続時は最後のスライド位置をサーバーから受け取る
+		ws.send(JSON.stringify({ type: "slide_get", v: PROTOCOL_VERSION }));
+		// resume が拒否されるとサーバーは新しいトークンを発行するので、毎回取り直す
+		ws.send(JSON.stringify({ type: "resume_token" }));
 	};
 
 	ws.onmessage = (event) => {
 		try {
 			if (connectionStatus.value === ConnectionStatusEnum.Connected) {
 				const data = JSON.parse(event.data);
-				// Dispatch to registered handlers
-				for (const handler of messageHandlers) {
-					handler(data);
+				// Dispatch to registered handlers; a poll_states frame carries
+				// one poll_state / poll_not_initialized per poll
+				const messages = data.type === "poll_states" ? data.polls : [data];
+				for (const message of messages) {
+					for (const handler of messageHandlers) {
+						handler(message);
+					}
+				}
+				// 速いページ送りでは古いフレームが後から届くことがある
+				if (data.type === "slide_sync") {
+					if (lastSlideSeq === null || data.seq > lastSlideSeq) {
+						lastSlideSeq = data.seq;
+						onUpdate(data.state);
+					}
+				}
+				if (data.type === "resume_token") {
+					sessionStorage.setItem(
+						"slide_resume",
+						JSON.stringify({ token: data.token, expiresAt: data.expiresAt, room: getRoom() }),
+					);
 				}
 				// Messages without "type" field go to slide sync (backward compat)
 				if (!data.type) {
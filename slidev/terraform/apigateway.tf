@@ -19,12 +19,23 @@ resource "aws_apigatewayv2_integration" "ws" {
   content_handling_strategy = "CONVERT_TO_TEXT"
 }
 
+resource "aws_apigatewayv2_authorizer" "ws" {
+  api_id          = aws_apigatewayv2_api.websocket.id
+  name            = "${var.project}-ws-session"
+  authorizer_type = "REQUEST"
+  authorizer_uri  = aws_lambda_function.ws_authorizer.invoke_arn
+}
+
 resource "aws_apigatewayv2_route" "ws" {
   #checkov:skip=CKV_AWS_309:Public WebSocket endpoint for browser slide sync
   for_each  = local.ws_handlers
   api_id    = aws_apigatewayv2_api.websocket.id
   route_key = each.value.route_key
   target    = "integrations/${aws_apigatewayv2_integration.ws[each.key].id}"
+
+  # Only $connect can be authorized; its context reaches every other route
+  authorization_type = each.key == "connect" ? "CUSTOM" : "NONE"
+  authorizer_id      = each.key == "connect" ? aws_apigatewayv2_authorizer.ws.id : null
 }
 
 # --- Login API Gateway ---
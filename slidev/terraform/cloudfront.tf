@@ -6,6 +6,56 @@ data "aws_cloudfront_origin_request_policy" "all_viewer_except_host" {
   name = "Managed-AllViewerExceptHostHeader"
 }
 
+# GET /login is cached per room; the login Lambda sets Cache-Control and
+# ETag on the error-free page and no-store on everything else. It gzips the
+# page only for viewers without br and leaves br to the behavior's compress
+resource "aws_cloudfront_cache_policy" "login" {
+  name        = "${var.project}-login"
+  min_ttl     = 0
+  default_ttl = 0
+  max_ttl     = 3600
+
+  parameters_in_cache_key_and_forwarded_to_origin {
+    enable_accept_encoding_gzip   = true
+    enable_accept_encoding_brotli = true
+
+    cookies_config {
+      cookie_behavior = "none"
+    }
+
+    headers_config {
+      header_behavior = "none"
+    }
+
+    query_strings_config {
+      query_string_behavior = "whitelist"
+      query_strings {
+        items = ["room"]
+      }
+    }
+  }
+}
+
+# /login only needs the query string (room) and the viewer IP for rate limiting
+resource "aws_cloudfront_origin_request_policy" "login" {
+  name = "${var.project}-login"
+
+  cookies_config {
+    cookie_behavior = "none"
+  }
+
+  headers_config {
+    header_behavior = "whitelist"
+    headers {
+      items = ["CloudFront-Viewer-Address"]
+    }
+  }
+
+  query_strings_config {
+    query_string_behavior = "all"
+  }
+}
+
 resource "aws_cloudfront_origin_access_control" "slidev" {
   name                              = var.project
   origin_access_control_origin_type = "s3"
@@ -29,6 +79,10 @@ resource "aws_cloudfront_distribution" "slidev" {
   origin {
     domain_name = "${aws_apigatewayv2_api.login.id}.execute-api.ap-northeast-1.amazonaws.com"
     origin_id   = local.cf_origin_id.login
+    custom_header {
+      name  = "X-Origin-Secret"
+      value = aws_secretsmanager_secret_version.login_origin_secret.secret_string
+    }
     custom_origin_config {
       http_port              = 80
       https_port             = 443
@@ -43,10 +97,10 @@ resource "aws_cloudfront_distribution" "slidev" {
     cached_methods         = ["GET", "HEAD"]
     target_origin_id       = local.cf_origin_id.login
     viewer_protocol_policy = "https-only"
-    compress               = false
+    compress               = true
 
-    cache_policy_id          = data.aws_cloudfront_cache_policy.caching_disabled.id
-    origin_request_policy_id = data.aws_cloudfront_origin_request_policy.all_viewer_except_host.id
+    cache_policy_id          = aws_cloudfront_cache_policy.login.id
+    origin_request_policy_id = aws_cloudfront_origin_request_policy.login.id
   }
 
   # /ws -> WebSocket API Gateway
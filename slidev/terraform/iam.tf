@@ -30,6 +30,8 @@ resource "aws_iam_policy" "ws_lambda_dynamodb" {
           "dynamodb:DeleteItem",
           "dynamodb:Query",
           "dynamodb:UpdateItem",
+          "dynamodb:BatchWriteItem",
+          "dynamodb:BatchGetItem",
         ]
         Resource = [
           aws_dynamodb_table.ws_connections.arn,
@@ -65,6 +67,53 @@ resource "aws_iam_role_policy_attachment" "ws_apigw" {
   policy_arn = aws_iam_policy.ws_lambda_apigw.arn
 }
 
+# $connect hands the trailing viewer_count broadcast of its window to an
+# asynchronous invocation of itself
+resource "aws_iam_policy" "ws_lambda_invoke" {
+  name = "${var.project}-ws-lambda-invoke"
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = "lambda:InvokeFunction"
+        Resource = aws_lambda_function.ws["connect"].arn
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "ws_invoke" {
+  role       = aws_iam_role.ws_lambda.name
+  policy_arn = aws_iam_policy.ws_lambda_invoke.arn
+}
+
+resource "aws_iam_policy" "ws_lambda_fanout" {
+  count = var.ws_fanout_enabled ? 1 : 0
+  name  = "${var.project}-ws-lambda-fanout"
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes",
+        ]
+        Resource = aws_sqs_queue.ws_fanout[0].arn
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "ws_fanout" {
+  count      = var.ws_fanout_enabled ? 1 : 0
+  role       = aws_iam_role.ws_lambda.name
+  policy_arn = aws_iam_policy.ws_lambda_fanout[0].arn
+}
+
 # --- Login Lambda ---
 
 resource "aws_iam_role" "auth_lambda" {
@@ -94,13 +143,17 @@ resource "aws_iam_policy" "auth_lambda" {
         Action = [
           "dynamodb:PutItem",
           "dynamodb:GetItem",
+          "dynamodb:UpdateItem",
         ]
         Resource = aws_dynamodb_table.sessions.arn
       },
       {
         Effect   = "Allow"
         Action   = "secretsmanager:GetSecretValue"
-        Resource = aws_secretsmanager_secret.auth_password_hash.arn
+        Resource = [
+          aws_secretsmanager_secret.auth_password_hash.arn,
+          aws_secretsmanager_secret.login_origin_secret.arn,
+        ]
       }
     ]
   })
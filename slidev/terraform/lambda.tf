@@ -19,9 +19,23 @@ resource "aws_lambda_function" "ws" {
 
   environment {
     variables = {
-      CONNECTIONS_TABLE_NAME = aws_dynamodb_table.ws_connections.name
-      SESSION_TABLE_NAME     = aws_dynamodb_table.sessions.name
-      POLL_TABLE_NAME        = aws_dynamodb_table.poll_votes.name
+      CONNECTIONS_TABLE_NAME   = aws_dynamodb_table.ws_connections.name
+      SESSION_TABLE_NAME       = aws_dynamodb_table.sessions.name
+      POLL_TABLE_NAME          = aws_dynamodb_table.poll_votes.name
+      BROADCAST_MAX_WORKERS    = var.ws_broadcast_max_workers
+      BROADCAST_SEND_TIMEOUT   = var.ws_broadcast_send_timeout
+      CONNECTION_CACHE_TTL     = var.ws_connection_cache_ttl
+      VIEWER_COUNT_WINDOW_MS   = var.ws_viewer_count_window_ms
+      POLL_BROADCAST_WINDOW_MS = var.ws_poll_broadcast_window_ms
+      POLL_VOTE_SHARDS         = var.ws_poll_vote_shards
+      STALE_PRUNE_ASYNC        = var.ws_stale_prune_async ? "1" : "0"
+      SESSION_CACHE_TTL        = var.ws_session_cache_ttl
+      FANOUT_QUEUE_URL         = var.ws_fanout_enabled ? aws_sqs_queue.ws_fanout[0].url : ""
+      FANOUT_THRESHOLD         = var.ws_fanout_threshold
+      FANOUT_CHUNK_SIZE        = var.ws_fanout_chunk_size
+      RESUME_GRACE_SECONDS     = var.ws_resume_grace_seconds
+      RESUME_TOKEN_TTL_SECONDS = var.ws_resume_token_ttl_seconds
+      METRICS_NAMESPACE        = var.project
     }
   }
 }
@@ -34,6 +48,69 @@ resource "aws_lambda_permission" "ws" {
   source_arn    = "${aws_apigatewayv2_api.websocket.execution_arn}/*/${each.value.route_key}"
 }
 
+data "archive_file" "ws_authorizer" {
+  type        = "zip"
+  source_dir  = "${path.module}/../ws-lambda/authorizer"
+  output_path = "${path.module}/../ws-lambda/authorizer.zip"
+}
+
+resource "aws_lambda_function" "ws_authorizer" {
+  filename         = data.archive_file.ws_authorizer.output_path
+  function_name    = "${var.project}-ws-authorizer"
+  role             = aws_iam_role.ws_lambda.arn
+  handler          = "handler.handler"
+  source_code_hash = data.archive_file.ws_authorizer.output_base64sha256
+  runtime          = "python3.14"
+  timeout          = 5
+
+  environment {
+    variables = {
+      CONNECTIONS_TABLE_NAME = aws_dynamodb_table.ws_connections.name
+      SESSION_TABLE_NAME     = aws_dynamodb_table.sessions.name
+      POLL_TABLE_NAME        = aws_dynamodb_table.poll_votes.name
+      SESSION_CACHE_TTL      = var.ws_session_cache_ttl
+      METRICS_NAMESPACE      = var.project
+    }
+  }
+}
+
+resource "aws_lambda_permission" "ws_authorizer" {
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.ws_authorizer.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_apigatewayv2_api.websocket.execution_arn}/authorizers/${aws_apigatewayv2_authorizer.ws.id}"
+}
+
+data "archive_file" "ws_fanout" {
+  count       = var.ws_fanout_enabled ? 1 : 0
+  type        = "zip"
+  source_dir  = "${path.module}/../ws-lambda/fanout"
+  output_path = "${path.module}/../ws-lambda/fanout.zip"
+}
+
+resource "aws_lambda_function" "ws_fanout" {
+  count            = var.ws_fanout_enabled ? 1 : 0
+  filename         = data.archive_file.ws_fanout[0].output_path
+  function_name    = "${var.project}-ws-fanout"
+  role             = aws_iam_role.ws_lambda.arn
+  handler          = "handler.handler"
+  source_code_hash = data.archive_file.ws_fanout[0].output_base64sha256
+  runtime          = "python3.14"
+  timeout          = 30
+
+  environment {
+    variables = {
+      CONNECTIONS_TABLE_NAME = aws_dynamodb_table.ws_connections.name
+      SESSION_TABLE_NAME     = aws_dynamodb_table.sessions.name
+      POLL_TABLE_NAME        = aws_dynamodb_table.poll_votes.name
+      BROADCAST_MAX_WORKERS  = var.ws_broadcast_max_workers
+      BROADCAST_SEND_TIMEOUT = var.ws_broadcast_send_timeout
+      STALE_PRUNE_ASYNC      = var.ws_stale_prune_async ? "1" : "0"
+      METRICS_NAMESPACE      = var.project
+    }
+  }
+}
+
 # --- Auth Lambda ---
 
 data "external" "auth_lambda_hash" {
@@ -65,9 +142,11 @@ resource "aws_lambda_layer_version" "bcrypt" {
   source_code_hash    = terraform_data.bcrypt_layer_build.id
 }
 
+# metrics.py is a symlink to the ws Lambdas' copy
 data "archive_file" "login" {
   type        = "zip"
-  source_file = "${path.module}/../auth-lambda/login.py"
+  source_dir  = "${path.module}/../auth-lambda"
+  excludes    = ["build-layer.sh", "bcrypt-layer.zip", "login.zip", "layer", "__pycache__"]
   output_path = "${path.module}/../auth-lambda/login.zip"
 }
 
@@ -79,12 +158,17 @@ resource "aws_lambda_function" "login" {
   source_code_hash = data.archive_file.login.output_base64sha256
   runtime          = "python3.14"
   timeout          = 10
+  memory_size      = var.login_memory_size
   layers           = [aws_lambda_layer_version.bcrypt.arn]
 
   environment {
     variables = {
-      SESSION_TABLE_NAME = aws_dynamodb_table.sessions.name
-      SECRET_ARN         = aws_secretsmanager_secret.auth_password_hash.arn
+      SESSION_TABLE_NAME        = aws_dynamodb_table.sessions.name
+      SECRET_ARN                = aws_secretsmanager_secret.auth_password_hash.arn
+      LOGIN_RATE_LIMIT          = var.login_rate_limit
+      LOGIN_RATE_WINDOW_SECONDS = var.login_rate_window_seconds
+      ORIGIN_SECRET_ARN         = aws_secretsmanager_secret.login_origin_secret.arn
+      METRICS_NAMESPACE         = var.project
     }
   }
 }
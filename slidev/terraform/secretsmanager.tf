@@ -2,3 +2,27 @@ resource "aws_secretsmanager_secret" "auth_password_hash" {
   #checkov:skip=CKV2_AWS_57:Auto rotation not applicable for static password hash
   name = "${var.project}-auth-password-hash"
 }
+
+# Sent by CloudFront to the login origin as X-Origin-Secret; the Lambda only
+# trusts CloudFront-Viewer-Address on requests that carry it, since the
+# execute-api endpoint itself is public
+resource "aws_secretsmanager_secret" "login_origin_secret" {
+  #checkov:skip=CKV2_AWS_57:Rotation would have to update the CloudFront origin header in step
+  name = "${var.project}-login-origin-secret"
+}
+
+# The data source returns a new password on every plan; only the first one
+# is stored
+data "aws_secretsmanager_random_password" "login_origin_secret" {
+  password_length     = 32
+  exclude_punctuation = true
+}
+
+resource "aws_secretsmanager_secret_version" "login_origin_secret" {
+  secret_id     = aws_secretsmanager_secret.login_origin_secret.id
+  secret_string = data.aws_secretsmanager_random_password.login_origin_secret.random_password
+
+  lifecycle {
+    ignore_changes = [secret_string]
+  }
+}
@@ -0,0 +1,33 @@
+# --- WebSocket broadcast fan-out ---
+
+resource "aws_sqs_queue" "ws_fanout_dlq" {
+  count                     = var.ws_fanout_enabled ? 1 : 0
+  name                      = "${var.project}-ws-fanout-dlq"
+  message_retention_seconds = 86400
+  sqs_managed_sse_enabled   = true
+}
+
+resource "aws_sqs_queue" "ws_fanout" {
+  count                      = var.ws_fanout_enabled ? 1 : 0
+  name                       = "${var.project}-ws-fanout"
+  visibility_timeout_seconds = 180 # 6x the fanout Lambda timeout
+  message_retention_seconds  = 3600
+  sqs_managed_sse_enabled    = true
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.ws_fanout_dlq[0].arn
+    maxReceiveCount     = 3
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "ws_fanout" {
+  count                   = var.ws_fanout_enabled ? 1 : 0
+  event_source_arn        = aws_sqs_queue.ws_fanout[0].arn
+  function_name           = aws_lambda_function.ws_fanout[0].arn
+  batch_size              = 1
+  function_response_types = ["ReportBatchItemFailures"]
+
+  scaling_config {
+    maximum_concurrency = var.ws_fanout_max_concurrency
+  }
+}
@@ -14,3 +14,110 @@ variable "rate_limit_excluded_cidrs" {
   type        = list(string)
   default     = []
 }
+
+variable "login_memory_size" {
+  description = "Memory (MB) for the login Lambda; bcrypt.checkpw is CPU-bound and 1769 MB is one full vCPU (see bench/checkpw.py)"
+  type        = number
+  default     = 1769
+}
+
+variable "login_rate_limit" {
+  description = "Login attempts allowed per source IP per window before bcrypt runs (0 disables)"
+  type        = number
+  default     = 10
+}
+
+variable "login_rate_window_seconds" {
+  description = "Length of the login rate limit window in seconds"
+  type        = number
+  default     = 300
+}
+
+variable "ws_broadcast_max_workers" {
+  description = "Number of concurrent post_to_connection calls per broadcast"
+  type        = number
+  default     = 32
+}
+
+variable "ws_broadcast_send_timeout" {
+  description = "Connect/read timeout in seconds for a single post_to_connection call"
+  type        = number
+  default     = 2
+}
+
+variable "ws_connection_cache_ttl" {
+  description = "Seconds a warm Lambda trusts its cached room membership before re-checking the room version"
+  type        = number
+  default     = 2
+}
+
+variable "ws_viewer_count_window_ms" {
+  description = "Coalescing window for viewer_count broadcasts per room (0 broadcasts on every join/leave)"
+  type        = number
+  default     = 1000
+}
+
+variable "ws_poll_broadcast_window_ms" {
+  description = "Coalescing window for poll_state tally broadcasts per poll (0 broadcasts on every vote)"
+  type        = number
+  default     = 500
+}
+
+variable "ws_poll_vote_shards" {
+  description = "Counter shards per poll for vote tallies, at most 99 (1 keeps every tally on the META item)"
+  type        = number
+  default     = 1
+
+  validation {
+    condition     = var.ws_poll_vote_shards >= 1 && var.ws_poll_vote_shards <= 99
+    error_message = "ws_poll_vote_shards must be between 1 and 99: META and every shard are created in one 100-item transaction."
+  }
+}
+
+variable "ws_stale_prune_async" {
+  description = "Delete GoneException connections on the worker pool instead of before broadcast() returns"
+  type        = bool
+  default     = false
+}
+
+variable "ws_session_cache_ttl" {
+  description = "Seconds a warm Lambda trusts a presenter session lookup (also how long a revoked session keeps working)"
+  type        = number
+  default     = 60
+}
+
+variable "ws_resume_grace_seconds" {
+  description = "Seconds a disconnected client can reconnect with its resume token without a viewer_count broadcast (the disconnect Lambda waits this long, so keep it well under its timeout)"
+  type        = number
+  default     = 5
+}
+
+variable "ws_resume_token_ttl_seconds" {
+  description = "Lifetime of a resume token issued on $connect"
+  type        = number
+  default     = 43200
+}
+
+variable "ws_fanout_enabled" {
+  description = "Create the SQS fan-out queue and sender Lambda for broadcasts to very large rooms"
+  type        = bool
+  default     = false
+}
+
+variable "ws_fanout_threshold" {
+  description = "Broadcasts to more connections than this go through the fan-out queue when it is enabled"
+  type        = number
+  default     = 500
+}
+
+variable "ws_fanout_chunk_size" {
+  description = "Connections per fan-out queue message"
+  type        = number
+  default     = 200
+}
+
+variable "ws_fanout_max_concurrency" {
+  description = "Maximum concurrent fan-out sender Lambdas (at least 2)"
+  type        = number
+  default     = 20
+}
@@ -0,0 +1,35 @@
+from wscore.connections import requested_room
+from wscore.metrics import instrument
+from wscore.sessions import get_session_token, verify_session
+
+
+def _policy(event, effect, context=None):
+    response = {
+        "principalId": event["requestContext"]["connectionId"],
+        "policyDocument": {
+            "Version": "2012-10-17",
+            "Statement": [{
+                "Action": "execute-api:Invoke",
+                "Effect": effect,
+                "Resource": event["methodArn"],
+            }],
+        },
+    }
+    if context is not None:
+        response["context"] = context
+    return response
+
+
+@instrument("authorizer")
+def handler(event, context):
+    """REQUEST authorizer for $connect.
+
+    Everyone with a valid room gets in; the cookie only decides the role,
+    which API Gateway hands to every route as requestContext.authorizer.
+    Viewers without a cookie never touch DynamoDB.
+    """
+    room = requested_room(event)
+    if room is None:
+        return _policy(event, "Deny")
+    role = "presenter" if verify_session(get_session_token(event), room) else "viewer"
+    return _policy(event, "Allow", {"role": role, "room": room})
@@ -1,60 +1,62 @@
-import os
-import time
-
-import boto3
-
-from broadcast import broadcast
-
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(os.environ["CONNECTIONS_TABLE_NAME"])
-session_table = dynamodb.Table(os.environ["SESSION_TABLE_NAME"])
-
-ROOM = "default"
-COOKIE_NAME = "slide_auth"
-
-
-def _get_session_token(event):
-    headers = event.get("headers") or {}
-    cookie_header = headers.get("cookie") or headers.get("Cookie") or ""
-    for part in cookie_header.split(";"):
-        part = part.strip()
-        if part.startswith(f"{COOKIE_NAME}="):
-            return part.split("=", 1)[1]
-    return None
-
-
-def _verify_session(token):
-    if not token:
-        return False
+from wscore.broadcast import broadcast_viewer_count, flush_viewer_count
+from wscore.connections import (
+    PROTOCOL_VERSION,
+    authorizer_role,
+    counted_as_departed,
+    note_connected,
+    put_connection,
+    remember_room,
+    requested_resume_token,
+    requested_room,
+    take_over_resume_token,
+)
+from wscore.metrics import instrument, set_route
+from wscore.sessions import get_session_token, verify_session
+
+
+def _get_protocol(event):
+    """Protocol version the client asked for with ?v=, capped at what we speak."""
+    params = event.get("queryStringParameters") or {}
     try:
-        response = session_table.get_item(Key={"token": token})
-        item = response.get("Item")
-        return item is not None and item.get("status") == "valid"
-    except Exception:
-        return False
+        requested = int(params.get("v", "1"))
+    except ValueError:
+        return 1
+    return max(1, min(requested, PROTOCOL_VERSION))
 
 
+@instrument("connect")
 def handler(event, context):
+    if "viewerCountFlush" in event:
+        # Asynchronous self-invocation from a $connect that opened a window
+        set_route("viewer_count_flush")
+        flush_viewer_count(event)
+        return {"statusCode": 200, "body": "Flushed"}
+
     connection_id = event["requestContext"]["connectionId"]
 
-    token = _get_session_token(event)
-    role = "presenter" if _verify_session(token) else "viewer"
-
-    table.put_item(
-        Item={
-            "room": ROOM,
-            "connectionId": connection_id,
-            "role": role,
-            "ttl": int(time.time()) + 86400,
-        }
-    )
-
-    count = table.query(
-        KeyConditionExpression="room = :r",
-        ExpressionAttributeValues={":r": ROOM},
-        Select="COUNT",
-    )["Count"]
-    broadcast(event, {"type": "viewer_count", "count": count},
-              exclude_connection_id=connection_id)
+    room = requested_room(event)
+    if room is None:
+        return {"statusCode": 400, "body": "Invalid room"}
+    remember_room(connection_id, room)
+
+    token = requested_resume_token(event)
+    resumed = token and take_over_resume_token(token, room, connection_id)
+
+    role = authorizer_role(event)
+    if role is None and resumed:
+        role = resumed["role"]
+    if role is None:
+        # No authorizer in front of this route (local runs): check the cookie here
+        role = "presenter" if verify_session(get_session_token(event), room) else "viewer"
+    protocol = _get_protocol(event)
+
+    put_connection(room, connection_id, role, protocol, (token, resumed["expiresAt"]) if resumed else None)
+    count = note_connected(room, connection_id, role, protocol)
+    if resumed and resumed["quiet"] and not counted_as_departed(room, resumed["leftAt"]):
+        # Back within the grace window: the room never saw it leave
+        return {"statusCode": 200, "body": "Resumed"}
+    # No waiting for the window here: the client's handshake is still open,
+    # so the trailing broadcast is sent by another invocation
+    broadcast_viewer_count(event, count, exclude_connection_id=connection_id, trailing=False)
 
     return {"statusCode": 200, "body": "Connected"}
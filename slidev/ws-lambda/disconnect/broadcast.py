@@ -1 +0,0 @@
-../message/broadcast.py
\ No newline at end of file
@@ -1,30 +1,36 @@
-import os
-
-import boto3
-
-from broadcast import broadcast
-
-dynamodb = boto3.resource("dynamodb")
-table = dynamodb.Table(os.environ["CONNECTIONS_TABLE_NAME"])
-
-ROOM = "default"
-
-
+from wscore.broadcast import broadcast_departure, broadcast_viewer_count
+from wscore.connections import (
+    delete_connection,
+    forget_room,
+    get_resume_token,
+    get_viewer_count,
+    note_disconnected,
+    release_resume_token,
+    room_for,
+)
+from wscore.metrics import instrument
+
+
+@instrument("disconnect")
 def handler(event, context):
     connection_id = event["requestContext"]["connectionId"]
-
-    table.delete_item(
-        Key={
-            "room": ROOM,
-            "connectionId": connection_id,
-        }
-    )
-
-    count = table.query(
-        KeyConditionExpression="room = :r",
-        ExpressionAttributeValues={":r": ROOM},
-        Select="COUNT",
-    )["Count"]
-    broadcast(event, {"type": "viewer_count", "count": count})
+    room = room_for(event)
+
+    # A broadcast may already have pruned this connection
+    connection = delete_connection(room, connection_id)
+    if connection is not None:
+        count = note_disconnected(room, connection_id)
+        token = connection["resumeToken"]
+    else:
+        count = get_viewer_count(room)
+        token = (get_resume_token(connection_id) or (None,))[0]
+
+    if token is None:
+        broadcast_viewer_count(event, count)
+    elif release_resume_token(token, connection_id):
+        # The client may be back within the grace window
+        broadcast_departure(event, count + 1)
+    # Otherwise a newer connection already holds the token: it never left
+    forget_room(connection_id)
 
     return {"statusCode": 200, "body": "Disconnected"}
@@ -0,0 +1,21 @@
+import json
+
+from wscore.fanout import handle_chunk
+from wscore.metrics import instrument
+
+
+@instrument("fanout")
+def handler(event, context):
+    """SQS-triggered sender for chunks queued by broadcast().
+
+    A chunk that fails is reported on its own and retried by SQS, so one bad
+    chunk never makes the rest of the batch resend.
+    """
+    failures = []
+    for record in event["Records"]:
+        try:
+            handle_chunk(json.loads(record["body"]))
+        except Exception as e:
+            print(json.dumps({"fanout_error": str(e), "messageId": record["messageId"]}))
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
@@ -1,30 +1,52 @@
 import json
 
-from poll.get import handle_poll_get
-from poll.vote import handle_poll_vote
-from poll.unvote import handle_poll_unvote
-from poll.switch import handle_poll_switch
-from slide_sync import handle_slide_sync
+from resume_token import handle_resume_token
+from slide_sync import handle_slide_get, handle_slide_sync
 from viewer_count import handle_viewer_count
+from wscore.metrics import instrument, set_route
 
+# Poll handlers are imported on first use so pure slide-sync containers
+# never load them.
 
+# Message types reported as their own Route in metrics; anything else is
+# forwarded as slide state
+ROUTES = {
+    "poll_vote", "poll_unvote", "poll_switch", "poll_get", "poll_get_many",
+    "viewer_count", "slide_get", "resume_token",
+}
+
+
+@instrument("message")
 def handler(event, context):
     body_str = event.get("body", "")
     try:
         body = json.loads(body_str)
     except (json.JSONDecodeError, TypeError):
         body = {}
+    route = body.get("type")
+    set_route(route if route in ROUTES else "slide_sync")
 
-    match body.get("type"):
+    match route:
         case "poll_vote":
+            from poll.vote import handle_poll_vote
             return handle_poll_vote(event, body)
         case "poll_unvote":
+            from poll.unvote import handle_poll_unvote
             return handle_poll_unvote(event, body)
         case "poll_switch":
+            from poll.switch import handle_poll_switch
             return handle_poll_switch(event, body)
         case "poll_get":
+            from poll.get import handle_poll_get
             return handle_poll_get(event, body)
+        case "poll_get_many":
+            from poll.get_many import handle_poll_get_many
+            return handle_poll_get_many(event, body)
         case "viewer_count":
             return handle_viewer_count(event, body)
+        case "slide_get":
+            return handle_slide_get(event, body)
+        case "resume_token":
+            return handle_resume_token(event, body)
         case _:
-            return handle_slide_sync(event, body_str)
+            return handle_slide_sync(event, body, body_str)
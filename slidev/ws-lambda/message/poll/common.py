@@ -1,113 +1,493 @@
-import json
+import os
+import random
+import time
 
-import boto3
 from botocore.exceptions import ClientError
 
-from broadcast import POLL_TTL_SECONDS, ROOM, broadcast, connections_table, poll_table
+from wscore.aws import poll_table
+from wscore.broadcast import broadcast, send_to_caller
+from wscore.connections import POLL_DELTA_PROTOCOL, room_for
 
 MAX_INPUT_LEN = 256
+POLL_TTL_SECONDS = 86400  # 24 hours
+POLL_BROADCAST_WINDOW_MS = int(os.environ.get("POLL_BROADCAST_WINDOW_MS", "500"))
+
+# With more than one shard, vote deltas go to a random "META#<n>" item
+# instead of META itself, and reads sum them. initialize_poll() writes META
+# and every shard in one transaction, which holds at most 100 items.
+POLL_VOTE_SHARDS = int(os.environ.get("POLL_VOTE_SHARDS", "1"))
+MAX_POLL_VOTE_SHARDS = 99
+if not 1 <= POLL_VOTE_SHARDS <= MAX_POLL_VOTE_SHARDS:
+    raise ValueError(f"POLL_VOTE_SHARDS must be between 1 and {MAX_POLL_VOTE_SHARDS}, got {POLL_VOTE_SHARDS}")
+POLL_TALLY_CACHE_TTL = float(os.environ.get("POLL_TALLY_CACHE_TTL", "1"))
+
+# BatchGetItem reads at most 100 keys per call
+BATCH_GET_MAX_KEYS = 100
+
+# Transactions on the same META item conflict while another is in flight;
+# those are retried with jittered backoff this many times in all
+TRANSACT_MAX_ATTEMPTS = 5
+TRANSACT_BACKOFF_SECONDS = 0.02
 
 
 def validate_strings(*values, max_len=MAX_INPUT_LEN):
     return all(isinstance(v, str) and 0 < len(v) <= max_len for v in values)
 
 
-def get_meta(poll_id):
-    resp = poll_table.get_item(Key={"pollId": poll_id, "connectionId": "META"})
-    return resp.get("Item")
+# options and maxChoices never change once META exists, so each container
+# reads them once per poll
+_poll_config_cache = {}
 
+# Summed shard tallies per poll: {pollId: (checked_at, votes)}
+_tally_cache = {}
 
-def get_votes_from_meta(meta):
-    return {k: int(v) for k, v in meta.get("votes", {}).items()}
 
+def scoped_poll_id(event, poll_id):
+    """Table pollId for a client's pollId: polls are scoped to the sender's room.
 
-def get_my_choices(poll_id, visitor_id):
-    existing = poll_table.query(
-        KeyConditionExpression="pollId = :pid AND begins_with(connectionId, :prefix)",
-        ExpressionAttributeValues={
-            ":pid": poll_id,
-            ":prefix": f"{visitor_id}#",
-        },
-    )
+    Every poll function below takes the scoped id; messages to clients carry
+    client_poll_id() of it.
+    """
+    return f"{room_for(event)}/{poll_id}"
+
+
+def client_poll_id(poll_id):
+    return poll_id.split("/", 1)[1]
+
+
+def meta_key(poll_id):
+    return {"pollId": poll_id, "connectionId": "META"}
+
+
+def shard_keys(poll_id, count=None, start=0):
+    """Keys of a poll's vote shards start..count - 1 (count defaults to POLL_VOTE_SHARDS)."""
+    count = POLL_VOTE_SHARDS if count is None else count
+    if count <= 1:
+        return []
     return [
-        item["connectionId"].split("#", 1)[1]
-        for item in existing.get("Items", [])
+        {"pollId": poll_id, "connectionId": f"META#{n}"}
+        for n in range(start, count)
     ]
 
 
-_apigw_client_cache = {}
+def shard_count(poll_id):
+    """Shards to read for a poll: max of the count META records and POLL_VOTE_SHARDS.
+
+    Until this container has seen the poll's META, POLL_VOTE_SHARDS.
+    """
+    config = _poll_config_cache.get(poll_id)
+    return config["shards"] if config else POLL_VOTE_SHARDS
+
+
+def tally_update(poll_id, update_expression, names, values):
+    """Transaction action that applies vote deltas to META or a random shard.
+
+    ADD votes.#c fails on an item without a votes map, so deltas only go to
+    shards that exist: get_poll_config() creates any the poll is missing (a
+    poll made before POLL_VOTE_SHARDS was raised) the first time this
+    container sees its META, and keeps using the recorded ones when
+    POLL_VOTE_SHARDS was lowered since. Without META the delta goes to META
+    itself, whose existence check then cancels the transaction.
+    """
+    params = {
+        "Key": meta_key(poll_id),
+        "UpdateExpression": update_expression,
+        "ConditionExpression": "attribute_exists(pollId)",
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+    }
+    config = get_poll_config(poll_id)
+    if config and config["shards"] > 1:
+        shard = random.randrange(config["shards"])
+        params["Key"] = {"pollId": poll_id, "connectionId": f"META#{shard}"}
+        del params["ConditionExpression"]
+    return ("Update", params)
+
+
+def broadcast_marker_key(poll_id):
+    """Per-poll broadcast marker, kept off META so it never conflicts with vote transactions."""
+    return {"pollId": poll_id, "connectionId": "BROADCAST"}
+
+
+def voter_key(poll_id, visitor_id):
+    """Per-visitor record holding the string set of chosen options."""
+    return {"pollId": poll_id, "connectionId": f"{visitor_id}#"}
 
 
-def _get_apigw_client(event):
-    domain = event["requestContext"]["domainName"]
-    stage = event["requestContext"]["stage"]
-    endpoint = f"https://{domain}/{stage}"
-    if endpoint not in _apigw_client_cache:
-        _apigw_client_cache[endpoint] = boto3.client(
-            "apigatewaymanagementapi", endpoint_url=endpoint
+def get_meta(poll_id, consistent=False):
+    resp = poll_table.get_item(Key=meta_key(poll_id), ConsistentRead=consistent)
+    return resp.get("Item")
+
+
+def _ensure_shards(poll_id, meta):
+    """Return how many vote shards the poll has, creating any POLL_VOTE_SHARDS needs.
+
+    META records how many shards the poll has, so this only writes when
+    POLL_VOTE_SHARDS has grown since; new shards get an empty votes map and
+    shards that already exist keep their counts. A poll that has more
+    shards than POLL_VOTE_SHARDS keeps all of them.
+    """
+    recorded = int(meta.get("shards", 1))
+    if recorded >= POLL_VOTE_SHARDS:
+        return recorded
+    for key in shard_keys(poll_id, start=recorded if recorded > 1 else 0):
+        poll_table.update_item(
+            Key=key,
+            UpdateExpression="SET votes = if_not_exists(votes, :empty)",
+            ExpressionAttributeValues={":empty": {}},
+        )
+    try:
+        poll_table.update_item(
+            Key=meta_key(poll_id),
+            UpdateExpression="SET shards = :shards",
+            ConditionExpression="attribute_not_exists(shards) OR shards < :shards",
+            ExpressionAttributeValues={":shards": POLL_VOTE_SHARDS},
         )
-    return _apigw_client_cache[endpoint]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+    return POLL_VOTE_SHARDS
+
 
+def get_poll_config(poll_id):
+    """Return {options, maxChoices, shards} for a poll, or None if META is missing.
+
+    The first time a container sees a poll's META it also makes sure the
+    poll has all its vote shards.
+    """
+    config = _poll_config_cache.get(poll_id)
+    if config is None:
+        meta = get_meta(poll_id)
+        if not meta:
+            return None
+        config = {
+            "options": meta.get("options", []),
+            "maxChoices": int(meta.get("maxChoices", 1)),
+            "shards": _ensure_shards(poll_id, meta),
+        }
+        _poll_config_cache[poll_id] = config
+    return config
+
+
+def transact_write(*actions):
+    """Run (action, params) pairs as one TransactWriteItems call.
+
+    Returns None on success, or the cancellation reason code of each action
+    ("ConditionalCheckFailed", "TransactionConflict", ...) when the
+    transaction is cancelled. Cancellations caused only by a conflicting
+    transaction are retried up to TRANSACT_MAX_ATTEMPTS times first.
+    """
+    for attempt in range(TRANSACT_MAX_ATTEMPTS):
+        try:
+            poll_table.meta.client.transact_write_items(TransactItems=[
+                {action: {"TableName": poll_table.name, **params}}
+                for action, params in actions
+            ])
+            return None
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+        if "TransactionConflict" not in reasons or "ConditionalCheckFailed" in reasons:
+            return reasons
+        time.sleep(random.uniform(0, TRANSACT_BACKOFF_SECONDS * 2 ** attempt))
+    return reasons
+
+
+def transaction_conflicted(reasons):
+    return "TransactionConflict" in reasons
+
+
+def condition_failed(reasons, index):
+    return index < len(reasons) and reasons[index] == "ConditionalCheckFailed"
+
+
+def get_votes_from_meta(meta):
+    return {k: int(v) for k, v in meta.get("votes", {}).items()}
+
+
+def _batch_get(keys, consistent):
+    """Return {pollId: {connectionId: item}} for the given keys.
+
+    Keys go BATCH_GET_MAX_KEYS per BatchGetItem call, and unprocessed ones
+    are retried.
+    """
+    items = {}
+    while keys:
+        batch, keys = keys[:BATCH_GET_MAX_KEYS], keys[BATCH_GET_MAX_KEYS:]
+        resp = poll_table.meta.client.batch_get_item(RequestItems={
+            poll_table.name: {"Keys": batch, "ConsistentRead": consistent},
+        })
+        for item in resp["Responses"].get(poll_table.name, []):
+            items.setdefault(item["pollId"], {})[item["connectionId"]] = item
+        keys = [*keys, *resp.get("UnprocessedKeys", {}).get(poll_table.name, {}).get("Keys", [])]
+    return items
 
-def send_to_caller(event, payload):
-    connection_id = event["requestContext"]["connectionId"]
-    apigw = _get_apigw_client(event)
-    apigw.post_to_connection(
-        ConnectionId=connection_id,
-        Data=json.dumps(payload).encode("utf-8"),
+
+def _load_polls(extra_keys, consistent=False):
+    """Return {poll_id: (meta or None, items)} for each poll in extra_keys.
+
+    extra_keys maps each poll to the other items to fetch with it; all of
+    them are read together. meta["votes"] is summed over the shards, and
+    meta also carries the broadcast marker's "seq" and "broadcastVotes", the
+    tallies as of the last broadcast. Inconsistent reads reuse the summed
+    tallies for POLL_TALLY_CACHE_TTL instead of fetching every shard again.
+
+    Shards are read up to shard_count(); when META records more than that
+    (POLL_VOTE_SHARDS was lowered and this container has not seen the poll
+    yet), the rest are fetched in a second round.
+    """
+    now = time.monotonic()
+    plans = {}
+    keys = []
+    for poll_id, extra in extra_keys.items():
+        cached = _tally_cache.get(poll_id)
+        use_cache = not consistent and cached and now - cached[0] < POLL_TALLY_CACHE_TTL
+        shards = [] if use_cache else shard_keys(poll_id, shard_count(poll_id))
+        plans[poll_id] = (cached if use_cache else None, shards)
+        keys += [meta_key(poll_id), broadcast_marker_key(poll_id), *shards, *extra]
+    found = _batch_get(keys, consistent)
+
+    missing = []
+    for poll_id, (cached, shards) in plans.items():
+        meta = found.get(poll_id, {}).get("META")
+        if cached or meta is None or int(meta.get("shards", 1)) <= max(len(shards), 1):
+            continue
+        more = shard_keys(poll_id, int(meta["shards"]), start=len(shards))
+        shards += more
+        missing += more
+    if missing:
+        for poll_id, items in _batch_get(missing, consistent).items():
+            found.setdefault(poll_id, {}).update(items)
+
+    polls = {}
+    for poll_id, (cached, shards) in plans.items():
+        items = found.get(poll_id, {})
+        meta = items.get("META")
+        polls[poll_id] = (meta, items)
+        if meta is None:
+            continue
+        marker = items.get("BROADCAST", {})
+        meta["seq"] = int(marker.get("broadcastSeq", 0))
+        meta["broadcastVotes"] = {k: int(v) for k, v in marker.get("broadcastVotes", {}).items()}
+        if cached:
+            meta["votes"] = cached[1]
+        elif shards:
+            votes = {}
+            for item in [meta, *(items.get(key["connectionId"], {}) for key in shards)]:
+                for choice, count in item.get("votes", {}).items():
+                    votes[choice] = votes.get(choice, 0) + int(count)
+            meta["votes"] = votes
+            _tally_cache[poll_id] = (now, votes)
+    return polls
+
+
+def get_poll_meta(poll_id, consistent=False):
+    meta, _ = _load_polls({poll_id: []}, consistent)[poll_id]
+    return meta
+
+
+def get_poll_states(poll_ids, visitor_id, consistent=False):
+    """Return {poll_id: (meta or None, sorted choices of the visitor)}.
+
+    Every poll, and the visitor's record in each, comes from the same
+    BatchGetItem calls.
+    """
+    polls = _load_polls(
+        {poll_id: [voter_key(poll_id, visitor_id)] for poll_id in poll_ids},
+        consistent,
     )
+    return {
+        poll_id: (meta, sorted(items.get(f"{visitor_id}#", {}).get("choices", ())))
+        for poll_id, (meta, items) in polls.items()
+    }
 
 
-def send_poll_error(event, poll_id, visitor_id, reason):
-    """Send current poll state with error back to caller so loading spinners are cleared."""
-    meta = get_meta(poll_id)
-    votes = get_votes_from_meta(meta) if meta else {}
-    my_choices = get_my_choices(poll_id, visitor_id)
-    send_to_caller(event, {
+def get_poll_state(poll_id, visitor_id, consistent=False):
+    """Return (meta or None, sorted choices of the visitor) in one BatchGetItem."""
+    return get_poll_states([poll_id], visitor_id, consistent)[poll_id]
+
+
+def poll_state_message(poll_id, meta, **extra):
+    """Full poll_state snapshot. seq lets protocol 2 clients resume deltas from it."""
+    return {
         "type": "poll_state",
-        "pollId": poll_id,
-        "votes": votes,
-        "myChoices": my_choices,
-        "error": reason,
-    })
+        "pollId": client_poll_id(poll_id),
+        "votes": get_votes_from_meta(meta) if meta else {},
+        "seq": meta["seq"] if meta else 0,
+        **extra,
+    }
+
+
+def send_poll_error(event, poll_id, visitor_id, reason, state=None):
+    """Send current poll state with error back to caller so loading spinners are cleared."""
+    meta, my_choices = state or get_poll_state(poll_id, visitor_id)
+    send_to_caller(event, poll_state_message(
+        poll_id, meta, myChoices=my_choices, error=reason,
+    ))
+
+
+def poll_error(event, poll_id, visitor_id, reason, state=None):
+    send_poll_error(event, poll_id, visitor_id, reason, state)
+    return {"statusCode": 200, "body": reason}
 
 
 def validate_meta_and_choices(event, poll_id, visitor_id, choices):
     """Validate META exists and all choices are valid options.
 
-    Returns (meta, None) on success, or (None, response_dict) on failure.
+    Returns (config, None) on success, or (None, response_dict) on failure.
     """
-    meta = get_meta(poll_id)
-    if not meta:
-        send_poll_error(event, poll_id, visitor_id, "Poll not initialized")
-        return None, {"statusCode": 200, "body": "Poll not initialized"}
+    config = get_poll_config(poll_id)
+    if not config:
+        return None, poll_error(event, poll_id, visitor_id, "Poll not initialized")
 
-    meta_options = meta.get("options", [])
+    meta_options = config["options"]
     if meta_options:
         for choice in choices:
             if choice not in meta_options:
-                send_poll_error(event, poll_id, visitor_id, "Invalid choice")
-                return None, {"statusCode": 200, "body": "Invalid choice"}
+                return None, poll_error(event, poll_id, visitor_id, "Invalid choice")
 
-    return meta, None
+    return config, None
 
 
-def broadcast_and_reply(event, poll_id, visitor_id, connection_id):
-    """Fetch updated META, broadcast to all, and send caller their state."""
-    meta = get_meta(poll_id)
-    votes = get_votes_from_meta(meta)
-    state_msg = json.dumps({
-        "type": "poll_state",
-        "pollId": poll_id,
-        "votes": votes,
-    })
+def initialize_poll(event, poll_id, options, max_choices):
+    """Create META (and its shards) for a presenter and tell the room it exists.
 
-    broadcast(event, state_msg, exclude_connection_id=connection_id)
+    A poll someone else created meanwhile is left as it is.
+    """
+    meta_item = {
+        "pollId": poll_id,
+        "connectionId": "META",
+        "options": options,
+        "maxChoices": max_choices,
+        "votes": {},
+    }
+    shards = shard_keys(poll_id)
+    if shards:
+        meta_item["shards"] = len(shards)
+        # Shards need their empty votes map before the first ADD votes.#c
+        reasons = transact_write(
+            ("Put", {
+                "Item": meta_item,
+                "ConditionExpression": "attribute_not_exists(pollId)",
+            }),
+            *(("Put", {"Item": {**key, "votes": {}}}) for key in shards),
+        )
+        if reasons and not condition_failed(reasons, 0):
+            raise RuntimeError(f"poll initialization cancelled: {reasons}")
+    else:
+        try:
+            poll_table.put_item(
+                Item=meta_item,
+                ConditionExpression="attribute_not_exists(pollId)",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
 
-    my_choices = get_my_choices(poll_id, visitor_id)
-    send_to_caller(event, {
+    # Broadcast to all connections so they know the poll is initialized
+    broadcast(event, {
         "type": "poll_state",
-        "pollId": poll_id,
-        "votes": votes,
-        "myChoices": my_choices,
+        "pollId": client_poll_id(poll_id),
+        "votes": {},
+        "seq": 0,
     })
+
+
+def claim_broadcast_window(poll_id):
+    """Single-flight marker per poll: True for the one caller per window."""
+    now_ms = int(time.time() * 1000)
+    try:
+        poll_table.update_item(
+            Key=broadcast_marker_key(poll_id),
+            UpdateExpression="SET broadcastAt = :now, #ttl = :ttl",
+            ConditionExpression="attribute_not_exists(broadcastAt) OR broadcastAt <= :due",
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={
+                ":now": now_ms,
+                ":due": now_ms - POLL_BROADCAST_WINDOW_MS,
+                ":ttl": int(time.time()) + POLL_TTL_SECONDS,
+            },
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+def _advance_seq(poll_id, meta, votes):
+    """Record a broadcast of votes as seq + 1; False if another caller got there first."""
+    try:
+        poll_table.update_item(
+            Key=broadcast_marker_key(poll_id),
+            UpdateExpression="SET broadcastSeq = :seq, broadcastVotes = :votes, #ttl = :ttl",
+            ConditionExpression="attribute_not_exists(broadcastSeq) OR broadcastSeq = :prev",
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={
+                ":seq": meta["seq"] + 1,
+                ":prev": meta["seq"],
+                ":votes": votes,
+                ":ttl": int(time.time()) + POLL_TTL_SECONDS,
+            },
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+def publish_tallies(event, poll_id, meta):
+    """Broadcast the tallies in meta.
+
+    Protocol 2 connections get a poll_delta with only the counts that changed
+    since the last broadcast, numbered by seq; older ones get the full
+    poll_state. If another broadcaster took the next seq, everyone gets the
+    full snapshot instead, which is always safe to apply. The writer is not
+    excluded, so its own seq stays contiguous.
+    """
+    votes = get_votes_from_meta(meta)
+    changed = {
+        choice: count for choice, count in votes.items()
+        if meta["broadcastVotes"].get(choice) != count
+    }
+    if not changed:
+        return
+    snapshot = {"type": "poll_state", "pollId": client_poll_id(poll_id), "votes": votes}
+    if not _advance_seq(poll_id, meta, votes):
+        broadcast(event, snapshot)
+        return
+    broadcast(
+        event,
+        {
+            "type": "poll_delta",
+            "pollId": client_poll_id(poll_id),
+            "seq": meta["seq"] + 1,
+            "votes": changed,
+        },
+        legacy_message=snapshot,
+        min_protocol=POLL_DELTA_PROTOCOL,
+    )
+
+
+def broadcast_and_reply(event, poll_id, visitor_id):
+    """Send the caller their state, then broadcast the tallies.
+
+    TransactWriteItems cannot return the updated items, so the tallies and
+    the caller's choices are read back with one strongly consistent
+    BatchGetItem. The caller's reply goes out at once. With
+    POLL_BROADCAST_WINDOW_MS set, only the first write per window
+    broadcasts: it waits the window out and sends the tallies as they are
+    then, covering every vote that landed meanwhile.
+    """
+    meta, my_choices = get_poll_state(poll_id, visitor_id, consistent=True)
+    send_to_caller(event, poll_state_message(poll_id, meta, myChoices=my_choices))
+
+    if POLL_BROADCAST_WINDOW_MS > 0:
+        if not claim_broadcast_window(poll_id):
+            return
+        time.sleep(POLL_BROADCAST_WINDOW_MS / 1000)
+        meta = get_poll_meta(poll_id, consistent=True)
+
+    publish_tallies(event, poll_id, meta)
@@ -0,0 +1,48 @@
+from poll.common import (
+    client_poll_id,
+    get_poll_states,
+    initialize_poll,
+    poll_state_message,
+    scoped_poll_id,
+    send_to_caller,
+    validate_strings,
+)
+from wscore.connections import connection_role
+
+MAX_POLLS_PER_GET = 50
+
+
+def handle_poll_get_many(event, body):
+    """poll_get for every poll in body["polls"], answered in one poll_states frame.
+
+    All polls and the visitor's records in them are read with shared
+    BatchGetItem calls. A missing poll is initialized when the caller is
+    the presenter (the room hears about it as with poll_get) and reported
+    as poll_not_initialized otherwise.
+    """
+    visitor_id = body.get("visitorId")
+    polls = body.get("polls")
+    if not validate_strings(visitor_id) or not isinstance(polls, list):
+        return {"statusCode": 200, "body": "Invalid poll_get_many"}
+    if not 0 < len(polls) <= MAX_POLLS_PER_GET:
+        return {"statusCode": 200, "body": "Invalid poll_get_many"}
+
+    requested = {}
+    for poll in polls:
+        if not isinstance(poll, dict) or not validate_strings(poll.get("pollId")):
+            return {"statusCode": 200, "body": "Invalid poll_get_many"}
+        requested[scoped_poll_id(event, poll["pollId"])] = poll
+
+    replies = []
+    for poll_id, (meta, my_choices) in get_poll_states(list(requested), visitor_id).items():
+        if meta:
+            replies.append(poll_state_message(poll_id, meta, myChoices=my_choices))
+        elif connection_role(event) == "presenter":
+            poll = requested[poll_id]
+            initialize_poll(event, poll_id, poll.get("options", []), poll.get("maxChoices", 1))
+        else:
+            replies.append({"type": "poll_not_initialized", "pollId": client_poll_id(poll_id)})
+
+    if replies:
+        send_to_caller(event, {"type": "poll_states", "polls": replies})
+    return {"statusCode": 200, "body": "OK"}
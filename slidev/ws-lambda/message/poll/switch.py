@@ -1,13 +1,19 @@
-import time
-
-from botocore.exceptions import ClientError
-
-from broadcast import POLL_TTL_SECONDS, poll_table
-from poll.common import broadcast_and_reply, validate_meta_and_choices, validate_strings
+from poll.common import (
+    broadcast_and_reply,
+    condition_failed,
+    get_poll_state,
+    poll_error,
+    scoped_poll_id,
+    tally_update,
+    transact_write,
+    transaction_conflicted,
+    validate_meta_and_choices,
+    validate_strings,
+    voter_key,
+)
 
 
 def handle_poll_switch(event, body):
-    connection_id = event["requestContext"]["connectionId"]
     poll_id = body.get("pollId")
     visitor_id = body.get("visitorId")
     from_choice = body.get("fromChoice")
@@ -15,6 +21,7 @@ def handle_poll_switch(event, body):
 
     if not validate_strings(poll_id, visitor_id, from_choice, to_choice):
         return {"statusCode": 200, "body": "Invalid poll_switch"}
+    poll_id = scoped_poll_id(event, poll_id)
 
     _, error = validate_meta_and_choices(
         event, poll_id, visitor_id, [from_choice, to_choice]
@@ -22,42 +29,38 @@ def handle_poll_switch(event, body):
     if error:
         return error
 
-    ttl_value = int(time.time()) + POLL_TTL_SECONDS
-    meta_key = {"pollId": poll_id, "connectionId": "META"}
-
-    # Delete the old vote (conditional — must exist)
-    from_key = {"pollId": poll_id, "connectionId": f"{visitor_id}#{from_choice}"}
-    try:
-        poll_table.delete_item(
-            Key=from_key,
-            ConditionExpression="attribute_exists(pollId)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            return {"statusCode": 200, "body": "Old vote not found"}
-        raise
-
-    # Create the new vote (conditional — must not already exist)
-    to_key = {"pollId": poll_id, "connectionId": f"{visitor_id}#{to_choice}"}
-    try:
-        poll_table.put_item(
-            Item={**to_key, "ttl": ttl_value},
-            ConditionExpression="attribute_not_exists(pollId)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            # Restore the old vote since new one already exists
-            poll_table.put_item(Item={**from_key, "ttl": ttl_value})
-            return {"statusCode": 200, "body": "Already voted for target choice"}
-        raise
+    # ADD and DELETE cannot touch the same set in one update, so the new set
+    # is computed here and written only if nobody changed it in between.
+    _, old_choices = get_poll_state(poll_id, visitor_id, consistent=True)
+    if from_choice not in old_choices:
+        return {"statusCode": 200, "body": "Old vote not found"}
+    if to_choice in old_choices:
+        return {"statusCode": 200, "body": "Already voted for target choice"}
+    new_choices = set(old_choices) - {from_choice} | {to_choice}
 
-    # Atomic update META votes: fromChoice -1, toChoice +1
-    poll_table.update_item(
-        Key=meta_key,
-        UpdateExpression="ADD votes.#from_c :dec, votes.#to_c :inc",
-        ExpressionAttributeNames={"#from_c": from_choice, "#to_c": to_choice},
-        ExpressionAttributeValues={":dec": -1, ":inc": 1},
+    reasons = transact_write(
+        ("Update", {
+            "Key": voter_key(poll_id, visitor_id),
+            "UpdateExpression": "SET choices = :new",
+            "ConditionExpression": "choices = :old",
+            "ExpressionAttributeValues": {":new": new_choices, ":old": set(old_choices)},
+        }),
+        tally_update(
+            poll_id,
+            "ADD votes.#from_c :dec, votes.#to_c :inc",
+            {"#from_c": from_choice, "#to_c": to_choice},
+            {":dec": -1, ":inc": 1},
+        ),
     )
+    if reasons:
+        if condition_failed(reasons, 1):
+            return poll_error(event, poll_id, visitor_id, "Poll not initialized")
+        if condition_failed(reasons, 0):
+            return poll_error(event, poll_id, visitor_id, "Vote changed concurrently")
+        if transaction_conflicted(reasons):
+            # Still conflicting after the retries: let the client try again
+            return poll_error(event, poll_id, visitor_id, "Too many votes at once, try again")
+        raise RuntimeError(f"poll_switch transaction cancelled: {reasons}")
 
-    broadcast_and_reply(event, poll_id, visitor_id, connection_id)
+    broadcast_and_reply(event, poll_id, visitor_id)
     return {"statusCode": 200, "body": "Switched"}
@@ -1,7 +1,14 @@
-from botocore.exceptions import ClientError
-
-from broadcast import poll_table
-from poll.common import broadcast_and_reply, validate_strings
+from poll.common import (
+    broadcast_and_reply,
+    condition_failed,
+    poll_error,
+    scoped_poll_id,
+    tally_update,
+    transact_write,
+    transaction_conflicted,
+    validate_strings,
+    voter_key,
+)
 
 
 def handle_poll_unvote(event, body):
@@ -11,29 +18,25 @@ def handle_poll_unvote(event, body):
 
     if not validate_strings(poll_id, visitor_id, choice):
         return {"statusCode": 200, "body": "Invalid poll_unvote"}
-
-    vote_key = {"pollId": poll_id, "connectionId": f"{visitor_id}#{choice}"}
-    meta_key = {"pollId": poll_id, "connectionId": "META"}
-
-    # Delete the vote record (only if it exists)
-    try:
-        poll_table.delete_item(
-            Key=vote_key,
-            ConditionExpression="attribute_exists(pollId)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            return {"statusCode": 200, "body": "Vote not found"}
-        raise
-
-    # Atomic decrement META votes
-    poll_table.update_item(
-        Key=meta_key,
-        UpdateExpression="ADD votes.#c :dec",
-        ExpressionAttributeNames={"#c": choice},
-        ExpressionAttributeValues={":dec": -1},
+    poll_id = scoped_poll_id(event, poll_id)
+
+    # Remove the choice (only if it was chosen) and decrement its tally
+    reasons = transact_write(
+        ("Update", {
+            "Key": voter_key(poll_id, visitor_id),
+            "UpdateExpression": "DELETE choices :choice",
+            "ConditionExpression": "contains(choices, :c)",
+            "ExpressionAttributeValues": {":choice": {choice}, ":c": choice},
+        }),
+        tally_update(poll_id, "ADD votes.#c :dec", {"#c": choice}, {":dec": -1}),
     )
+    if reasons:
+        if condition_failed(reasons, 0):
+            return {"statusCode": 200, "body": "Vote not found"}
+        if transaction_conflicted(reasons):
+            # Still conflicting after the retries: let the client try again
+            return poll_error(event, poll_id, visitor_id, "Too many votes at once, try again")
+        raise RuntimeError(f"poll_unvote transaction cancelled: {reasons}")
 
-    connection_id = event["requestContext"]["connectionId"]
-    broadcast_and_reply(event, poll_id, visitor_id, connection_id)
+    broadcast_and_reply(event, poll_id, visitor_id)
     return {"statusCode": 200, "body": "Unvoted"}
@@ -1,63 +1,67 @@
 import time
 
-from botocore.exceptions import ClientError
-
-from broadcast import POLL_TTL_SECONDS, poll_table
 from poll.common import (
+    POLL_TTL_SECONDS,
     broadcast_and_reply,
-    send_poll_error,
+    condition_failed,
+    get_poll_state,
+    poll_error,
+    scoped_poll_id,
+    tally_update,
+    transact_write,
+    transaction_conflicted,
     validate_meta_and_choices,
     validate_strings,
+    voter_key,
 )
 
 
 def handle_poll_vote(event, body):
-    connection_id = event["requestContext"]["connectionId"]
     poll_id = body.get("pollId")
     visitor_id = body.get("visitorId")
     choice = body.get("choice")
 
     if not validate_strings(poll_id, visitor_id, choice):
         return {"statusCode": 200, "body": "Invalid poll_vote"}
+    poll_id = scoped_poll_id(event, poll_id)
 
-    meta, error = validate_meta_and_choices(event, poll_id, visitor_id, [choice])
+    config, error = validate_meta_and_choices(event, poll_id, visitor_id, [choice])
     if error:
         return error
 
-    # Check max_choices limit
-    meta_max_choices = meta.get("maxChoices", 1)
-    existing_votes = poll_table.query(
-        KeyConditionExpression="pollId = :pid AND begins_with(connectionId, :prefix)",
-        ExpressionAttributeValues={
-            ":pid": poll_id,
-            ":prefix": f"{visitor_id}#",
-        },
+    # The visitor's choice set and the META tally change together: the
+    # conditions enforce uniqueness, maxChoices and META existence.
+    reasons = transact_write(
+        ("Update", {
+            "Key": voter_key(poll_id, visitor_id),
+            "UpdateExpression": "ADD choices :choice SET #ttl = :ttl",
+            "ConditionExpression": (
+                "attribute_not_exists(choices) OR "
+                "(NOT contains(choices, :c) AND size(choices) < :max)"
+            ),
+            "ExpressionAttributeNames": {"#ttl": "ttl"},
+            "ExpressionAttributeValues": {
+                ":choice": {choice},
+                ":c": choice,
+                ":max": config["maxChoices"],
+                ":ttl": int(time.time()) + POLL_TTL_SECONDS,
+            },
+        }),
+        tally_update(poll_id, "ADD votes.#c :inc", {"#c": choice}, {":inc": 1}),
     )
-    if existing_votes["Count"] >= meta_max_choices:
-        send_poll_error(event, poll_id, visitor_id, "Max choices reached")
-        return {"statusCode": 200, "body": "Max choices reached"}
-
-    # Check for duplicate vote on same choice (conditional put)
-    ttl_value = int(time.time()) + POLL_TTL_SECONDS
-    meta_key = {"pollId": poll_id, "connectionId": "META"}
-    vote_key = {"pollId": poll_id, "connectionId": f"{visitor_id}#{choice}"}
-    try:
-        poll_table.put_item(
-            Item={**vote_key, "ttl": ttl_value},
-            ConditionExpression="attribute_not_exists(pollId)",
-        )
-    except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+    if reasons:
+        if condition_failed(reasons, 1):
+            return poll_error(event, poll_id, visitor_id, "Poll not initialized")
+        if condition_failed(reasons, 0):
+            # One condition covers both cases; the current set tells them apart
+            state = get_poll_state(poll_id, visitor_id, consistent=True)
+            if len(state[1]) >= config["maxChoices"]:
+                return poll_error(event, poll_id, visitor_id, "Max choices reached", state)
             return {"statusCode": 200, "body": "Already voted for this choice"}
-        raise
-
-    # Atomic increment META votes
-    poll_table.update_item(
-        Key=meta_key,
-        UpdateExpression="ADD votes.#c :inc",
-        ExpressionAttributeNames={"#c": choice},
-        ExpressionAttributeValues={":inc": 1},
-    )
+        if transaction_conflicted(reasons):
+            # Still conflicting after the retries: let the client try again
+            return poll_error(event, poll_id, visitor_id, "Too many votes at once, try again")
+        raise RuntimeError(f"poll_vote transaction cancelled: {reasons}")
 
-    broadcast_and_reply(event, poll_id, visitor_id, connection_id)
+    broadcast_and_reply(event, poll_id, visitor_id)
     return {"statusCode": 200, "body": "Voted"}
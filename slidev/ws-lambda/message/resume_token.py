@@ -0,0 +1,16 @@
+from wscore.broadcast import send_to_caller
+from wscore.connections import get_resume_token
+
+
+def handle_resume_token(event, body):
+    """Tell the caller the resume token its connection was issued.
+
+    Clients ask after every connect, since a rejected resume gets a new
+    token, and reconnect with ?resume=<token> until expiresAt.
+    """
+    resume = get_resume_token(event["requestContext"]["connectionId"])
+    if resume is None:
+        return {"statusCode": 200, "body": "No resume token"}
+    token, expires_at = resume
+    send_to_caller(event, {"type": "resume_token", "token": token, "expiresAt": expires_at})
+    return {"statusCode": 200, "body": "OK"}
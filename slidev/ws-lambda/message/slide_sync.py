@@ -1,15 +1,101 @@
-from broadcast import ROOM, broadcast, connections_table
+import json
+import os
+import threading
+import time
 
+from wscore.broadcast import broadcast, send_to_caller
+from wscore.connections import (
+    SLIDE_SEQ_PROTOCOL,
+    connection_role,
+    get_slide_seq,
+    get_slide_state,
+    room_for,
+    save_slide_state,
+)
 
-def handle_slide_sync(event, body_str):
+# How often an in-flight slide broadcast re-reads the room's slideSeq to see
+# whether a newer sync has superseded it
+SLIDE_SEQ_CHECK_MS = int(os.environ.get("SLIDE_SEQ_CHECK_MS", "50"))
+
+# Newest slideSeq this container has seen per room
+_latest_seq = {}
+_latest_seq_lock = threading.Lock()
+
+
+def _envelope(seq, body):
+    return {"type": "slide_sync", "seq": seq, "state": body}
+
+
+def _note_seq(room, seq):
+    with _latest_seq_lock:
+        if seq > _latest_seq.get(room, 0):
+            _latest_seq[room] = seq
+
+
+def _still_latest(room, seq):
+    """should_continue() for a broadcast of seq: False once a newer sync exists.
+
+    Syncs saved by this container are seen at once; other containers'
+    syncs are picked up from META at most every SLIDE_SEQ_CHECK_MS.
+    """
+    checked_at = time.monotonic()
+    lock = threading.Lock()
+
+    def should_continue():
+        nonlocal checked_at
+        if _latest_seq.get(room, 0) > seq:
+            return False
+        if lock.acquire(blocking=False):
+            try:
+                now = time.monotonic()
+                if (now - checked_at) * 1000 >= SLIDE_SEQ_CHECK_MS:
+                    checked_at = now
+                    _note_seq(room, get_slide_seq(room))
+            finally:
+                lock.release()
+        return _latest_seq.get(room, 0) <= seq
+
+    return should_continue
+
+
+def handle_slide_sync(event, body, body_str):
     connection_id = event["requestContext"]["connectionId"]
 
-    response = connections_table.get_item(
-        Key={"room": ROOM, "connectionId": connection_id}
-    )
-    sender = response.get("Item")
-    if not sender or sender.get("role") != "presenter":
+    if connection_role(event) != "presenter":
         return {"statusCode": 200, "body": "Ignored"}
 
-    broadcast(event, body_str, exclude_connection_id=connection_id)
+    # Other state (drawings etc.) is forwarded as is
+    if "page" not in body:
+        broadcast(event, body_str, exclude_connection_id=connection_id)
+        return {"statusCode": 200, "body": "Sent"}
+
+    # Navigation state is kept for late joiners and numbered, so a newer
+    # sync cuts this broadcast short and clients can drop stale frames
+    room = room_for(event)
+    seq = save_slide_state(room, body_str)
+    _note_seq(room, seq)
+    broadcast(
+        event,
+        _envelope(seq, body),
+        exclude_connection_id=connection_id,
+        legacy_message=body_str,
+        min_protocol=SLIDE_SEQ_PROTOCOL,
+        should_continue=_still_latest(room, seq),
+    )
     return {"statusCode": 200, "body": "Sent"}
+
+
+def handle_slide_get(event, body):
+    """Send the caller the room's last slide sync.
+
+    Clients that send v >= SLIDE_SEQ_PROTOCOL get it in a slide_sync
+    envelope; older ones get it as the presenter sent it.
+    """
+    state, seq = get_slide_state(room_for(event))
+    if state is None:
+        return {"statusCode": 200, "body": "No slide state"}
+    version = body.get("v")
+    if isinstance(version, int) and version >= SLIDE_SEQ_PROTOCOL:
+        state = _envelope(seq, json.loads(state))
+    send_to_caller(event, state)
+    return {"statusCode": 200, "body": "OK"}
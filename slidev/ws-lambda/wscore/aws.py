@@ -0,0 +1,90 @@
+import os
+
+import boto3
+from botocore.config import Config
+
+from wscore.metrics import instrument_client
+
+CONNECTIONS_TABLE_NAME = os.environ["CONNECTIONS_TABLE_NAME"]
+SESSION_TABLE_NAME = os.environ["SESSION_TABLE_NAME"]
+POLL_TABLE_NAME = os.environ["POLL_TABLE_NAME"]
+
+BROADCAST_MAX_WORKERS = int(os.environ.get("BROADCAST_MAX_WORKERS", "32"))
+BROADCAST_SEND_TIMEOUT = float(os.environ.get("BROADCAST_SEND_TIMEOUT", "2"))
+
+# Nothing is built at import time: each client is created on first use and
+# then shared by every handler module for the life of the container.
+_dynamodb_client = None
+_sqs_client = None
+_lambda_client = None
+_apigw_client_cache = {}
+
+
+def dynamodb_client():
+    """Low-level DynamoDB client for the hot paths.
+
+    Much cheaper to build than boto3.resource("dynamodb"), which also has to
+    load and generate the resource model.
+    """
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        _dynamodb_client = instrument_client(boto3.client("dynamodb"))
+    return _dynamodb_client
+
+
+def sqs_client():
+    global _sqs_client
+    if _sqs_client is None:
+        _sqs_client = instrument_client(boto3.client("sqs"))
+    return _sqs_client
+
+
+class _LazyTable:
+    """A boto3 Table that is only built when first used.
+
+    Routes that never touch the table (slide sync, presence) skip the
+    resource model entirely.
+    """
+
+    def __init__(self, table_name):
+        self._table_name = table_name
+        self._table = None
+
+    def __getattr__(self, name):
+        if self._table is None:
+            self._table = boto3.resource("dynamodb").Table(self._table_name)
+            instrument_client(self._table.meta.client)
+        return getattr(self._table, name)
+
+
+def lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        _lambda_client = instrument_client(boto3.client("lambda"))
+    return _lambda_client
+
+
+poll_table = _LazyTable(POLL_TABLE_NAME)
+
+
+def get_apigw_client(event):
+    """Management API client for the event's endpoint, cached per container.
+
+    Its connection pool matches the broadcast worker pool so every worker can
+    hold its own connection.
+    """
+    domain = event["requestContext"]["domainName"]
+    stage = event["requestContext"]["stage"]
+    endpoint = f"https://{domain}/{stage}"
+    if endpoint not in _apigw_client_cache:
+        _apigw_client_cache[endpoint] = instrument_client(boto3.client(
+            "apigatewaymanagementapi",
+            endpoint_url=endpoint,
+            config=Config(
+                max_pool_connections=BROADCAST_MAX_WORKERS,
+                connect_timeout=BROADCAST_SEND_TIMEOUT,
+                read_timeout=BROADCAST_SEND_TIMEOUT,
+                retries={"max_attempts": 2, "mode": "standard"},
+            ),
+        ))
+    return _apigw_client_cache[endpoint]
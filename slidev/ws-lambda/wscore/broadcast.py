@@ -0,0 +1,292 @@
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from wscore.aws import BROADCAST_MAX_WORKERS, get_apigw_client, lambda_client
+from wscore.connections import (
+    PROTOCOL_VERSION,
+    RESUME_GRACE_SECONDS,
+    claim_window,
+    delete_connections,
+    get_viewer_count,
+    iter_connections,
+    note_departure_check,
+    note_pruned,
+    room_for,
+)
+from wscore.fanout import FANOUT_QUEUE_URL, FANOUT_THRESHOLD, enqueue, should_fan_out
+from wscore.metrics import add, record_broadcast
+
+VIEWER_COUNT_WINDOW_MS = int(os.environ.get("VIEWER_COUNT_WINDOW_MS", "1000"))
+STALE_PRUNE_ASYNC = os.environ.get("STALE_PRUNE_ASYNC") == "1"
+
+# Bounded worker pool shared across warm invocations
+_executor = ThreadPoolExecutor(max_workers=BROADCAST_MAX_WORKERS)
+
+
+def encode(message):
+    """Serialize a payload once, without the whitespace json.dumps adds by default."""
+    if isinstance(message, dict):
+        message = json.dumps(message, separators=(",", ":"))
+    return message.encode("utf-8")
+
+
+def send_to_connection(event, connection_id, payload):
+    apigw = get_apigw_client(event)
+    apigw.post_to_connection(ConnectionId=connection_id, Data=encode(payload))
+
+
+def send_to_caller(event, payload):
+    send_to_connection(event, event["requestContext"]["connectionId"], payload)
+
+
+def _send(apigw, connection_id, data, should_continue=None):
+    """Post to one connection. Returns (connection_id, outcome, error, seconds).
+
+    The post is skipped when should_continue() says the message is no
+    longer worth sending.
+    """
+    if should_continue is not None and not should_continue():
+        return connection_id, "skipped", None, 0.0
+    started = time.perf_counter()
+    try:
+        apigw.post_to_connection(ConnectionId=connection_id, Data=data)
+        outcome, error = "sent", None
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "GoneException":
+            outcome, error = "stale", None
+        else:
+            outcome, error = "error", e
+    except BotoCoreError as e:
+        # Timeouts and connection resets only cost this one recipient
+        outcome, error = "failed", e
+    return connection_id, outcome, error, time.perf_counter() - started
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _prune_stale(room, stale):
+    """Remove connections that answered GoneException.
+
+    The version bump runs inline so this container and its peers stop
+    sending to them right away. The deletes themselves can run on the worker
+    pool (STALE_PRUNE_ASYNC=1); if the container is frozen before they
+    finish, they resume on its next invocation.
+    """
+    note_pruned(room, stale)
+    if STALE_PRUNE_ASYNC:
+        _executor.submit(delete_connections, room, stale)
+    else:
+        delete_connections(room, stale)
+
+
+def deliver(event, room, targets, should_continue=None):
+    """Post each (connection_id, data) in targets and prune the stale ones.
+
+    Sends run concurrently on the shared worker pool and start as soon as
+    targets yields its first entry. Each worker asks should_continue()
+    before posting, so a superseded broadcast stops partway. Returns the
+    per-broadcast stats that are also written to the log, and re-raises the
+    first unexpected send error.
+    """
+    started = time.perf_counter()
+    apigw = get_apigw_client(event)
+
+    futures = [
+        _executor.submit(_send, apigw, connection_id, data, should_continue)
+        for connection_id, data in targets
+    ]
+
+    stale = []
+    latencies = []
+    failed = 0
+    skipped = 0
+    first_error = None
+    for future in futures:
+        connection_id, outcome, error, seconds = future.result()
+        if outcome == "skipped":
+            skipped += 1
+            continue
+        latencies.append(seconds)
+        if outcome == "stale":
+            stale.append(connection_id)
+        elif outcome != "sent":
+            failed += 1
+            if outcome == "error" and first_error is None:
+                first_error = error
+
+    sent_at = time.perf_counter()
+    if stale:
+        _prune_stale(room, stale)
+
+    latencies.sort()
+    stats = {
+        "room": room,
+        "recipients": len(futures),
+        "stale": len(stale),
+        "failed": failed,
+        "skipped": skipped,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "prune_ms": round((time.perf_counter() - sent_at) * 1000, 1),
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    print(json.dumps({"broadcast": stats}))
+    record_broadcast(stats)
+
+    if first_error is not None:
+        raise first_error
+    return stats
+
+
+def broadcast(
+    event,
+    message,
+    exclude_connection_id=None,
+    legacy_message=None,
+    min_protocol=PROTOCOL_VERSION,
+    should_continue=None,
+):
+    """Fan a message out to every connection in the sender's room.
+
+    Connections older than min_protocol get legacy_message instead, when
+    one is given. Each payload is serialized once. Rooms larger than
+    FANOUT_THRESHOLD are handed to the fanout queue when it is configured
+    (should_continue is not checked there); otherwise this invocation sends
+    to everyone itself.
+    """
+    started = time.perf_counter()
+    room = room_for(event)
+
+    payloads = [encode(message)]
+    if legacy_message is not None:
+        payloads.append(encode(legacy_message))
+    legacy_index = len(payloads) - 1
+
+    targets = (
+        (
+            item["connectionId"],
+            0 if item.get("protocol", 1) >= min_protocol else legacy_index,
+        )
+        for item in iter_connections(room)
+        if not (exclude_connection_id and item["connectionId"] == exclude_connection_id)
+    )
+    if FANOUT_QUEUE_URL:
+        # Buffer only as many targets as it takes to tell whether the room
+        # is over the threshold
+        head = list(itertools.islice(targets, FANOUT_THRESHOLD + 1))
+        if should_fan_out(len(head)):
+            targets = [*head, *targets]
+            stats = {
+                "room": room,
+                "recipients": len(targets),
+                "chunks": enqueue(event, room, targets, payloads),
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            print(json.dumps({"broadcast_enqueued": stats}))
+            add("BroadcastsEnqueued", 1)
+            add("BroadcastRecipients", stats["recipients"])
+            add("FanoutChunks", stats["chunks"])
+            return stats
+        targets = itertools.chain(head, targets)
+
+    return deliver(
+        event,
+        room,
+        ((connection_id, payloads[index]) for connection_id, index in targets),
+        should_continue,
+    )
+
+
+def broadcast_viewer_count(event, count, exclude_connection_id=None, trailing=True):
+    """Broadcast the room's viewer count at most once per VIEWER_COUNT_WINDOW_MS.
+
+    Only the first caller in a window broadcasts; everyone else returns
+    without broadcasting. The first caller waits the window out and then
+    sends whatever the counter says, so every join or leave that landed
+    meanwhile is covered by that one fan-out. $connect passes
+    trailing=False, because API Gateway holds the client's handshake until
+    it returns: it sends count at once and leaves the wait and the trailing
+    send to schedule_viewer_count_flush().
+    """
+    if VIEWER_COUNT_WINDOW_MS > 0:
+        room = room_for(event)
+        if not claim_window(room, "countBroadcastAt", VIEWER_COUNT_WINDOW_MS):
+            return None
+        if trailing:
+            time.sleep(VIEWER_COUNT_WINDOW_MS / 1000)
+            count = get_viewer_count(room)
+        else:
+            schedule_viewer_count_flush(event, room, count)
+    return broadcast(
+        event,
+        {"type": "viewer_count", "count": count},
+        exclude_connection_id=exclude_connection_id,
+    )
+
+
+def schedule_viewer_count_flush(event, room, count):
+    """Send the trailing edge of a $connect's viewer_count window off the handshake.
+
+    In Lambda the function invokes itself asynchronously with a
+    viewerCountFlush event; elsewhere (local runs, benchmarks) the flush
+    runs on the worker pool.
+    """
+    flush_event = {
+        "viewerCountFlush": {"count": count},
+        "requestContext": {
+            "domainName": event["requestContext"]["domainName"],
+            "stage": event["requestContext"]["stage"],
+            "authorizer": {"room": room},
+        },
+    }
+    function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
+    if function_name:
+        lambda_client().invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps(flush_event).encode("utf-8"),
+        )
+    else:
+        _executor.submit(flush_viewer_count, flush_event)
+
+
+def flush_viewer_count(event):
+    """Wait out the window and broadcast the count if it changed since the leading edge."""
+    time.sleep(VIEWER_COUNT_WINDOW_MS / 1000)
+    count = get_viewer_count(room_for(event))
+    if count == event["viewerCountFlush"]["count"]:
+        return None
+    return broadcast(event, {"type": "viewer_count", "count": count})
+
+
+def broadcast_departure(event, previous_count):
+    """Presence broadcast for a connection whose client may resume.
+
+    The first such departure per RESUME_GRACE_SECONDS waits the grace
+    window out and broadcasts the room's count only if it no longer matches
+    previous_count, the count before that departure. Clients that resume
+    in time are back by then and their reconnects are quiet, so a blip
+    that heals broadcasts nothing; later departures in the window are
+    covered by the same check. Such a later client may still be inside its
+    own grace window when the check runs, so the check is recorded first and
+    a quiet resume after it broadcasts the count after all.
+    """
+    room = room_for(event)
+    if not claim_window(room, "departureBroadcastAt", int(RESUME_GRACE_SECONDS * 1000)):
+        return None
+    time.sleep(RESUME_GRACE_SECONDS)
+    note_departure_check(room)
+    count = get_viewer_count(room)
+    if count == previous_count:
+        return None
+    return broadcast(event, {"type": "viewer_count", "count": count})
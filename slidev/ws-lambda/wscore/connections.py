@@ -0,0 +1,617 @@
+import json
+import os
+import re
+import secrets
+import time
+
+from botocore.exceptions import ClientError
+
+from wscore.aws import CONNECTIONS_TABLE_NAME, dynamodb_client
+
+# Connection items are plain strings and numbers, so this module talks to the
+# low-level client directly instead of paying for the boto3 resource model.
+
+# Each room is one partition of the connections table. Clients pick one with
+# ?room= on $connect; connections made before rooms existed are in "default".
+DEFAULT_ROOM = "default"
+ROOM_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+CONNECTION_TTL_SECONDS = 86400  # 24 hours
+
+# Wire protocol: 1 is the original full-state messages, 2 adds poll_delta,
+# 3 wraps slide syncs in seq-numbered slide_sync envelopes. Clients ask for
+# one with ?v= on $connect.
+PROTOCOL_VERSION = 3
+POLL_DELTA_PROTOCOL = 2
+SLIDE_SEQ_PROTOCOL = 3
+
+# Room-level item kept in the same partition as the room's connections
+META_CONNECTION_ID = "META"
+CONNECTION_CACHE_TTL = float(os.environ.get("CONNECTION_CACHE_TTL", "2"))
+VIEWER_COUNT_RECONCILE_SECONDS = int(os.environ.get("VIEWER_COUNT_RECONCILE_SECONDS", "60"))
+
+# Every new connection is issued a resume token, kept in its own
+# "resume#<token>" partition with the room, the role and the connection
+# holding it. A client that reconnects with ?resume=<token> takes it over;
+# if it comes back within RESUME_GRACE_SECONDS, or before its old
+# connection was even noticed as gone, nobody hears about it.
+RESUME_TOKEN_TTL_SECONDS = int(os.environ.get("RESUME_TOKEN_TTL_SECONDS", "43200"))
+RESUME_GRACE_SECONDS = float(os.environ.get("RESUME_GRACE_SECONDS", "5"))
+RESUME_TOKEN_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+BATCH_WRITE_SIZE = 25  # BatchWriteItem limit
+BATCH_WRITE_MAX_ATTEMPTS = 5
+
+# Room membership as last loaded by this container, per room:
+# {room: {members: {connectionId: {connectionId, role, protocol}}, version,
+# checked_at}}, tagged with the META version it was loaded at.
+_memberships = {}
+
+# connectionId -> room for connections this container has seen. A
+# connection never changes rooms, so entries only go stale by disconnecting.
+_rooms = {}
+ROOM_CACHE_SIZE = 10000
+
+# connectionId -> (role, expires_at). A role is fixed at $connect, so the TTL
+# only bounds how long entries for departed connections linger.
+ROLE_CACHE_TTL = float(os.environ.get("ROLE_CACHE_TTL", "300"))
+_roles = {}
+
+
+def _key(room, connection_id):
+    return {"room": {"S": room}, "connectionId": {"S": connection_id}}
+
+
+def _lookup_key(connection_id):
+    """connectionId -> room item, alone in its own "#<connectionId>" partition."""
+    return _key(f"#{connection_id}", connection_id)
+
+
+def _resume_key(token):
+    return _key(f"resume#{token}", token)
+
+
+def _number(item, attr):
+    return int(item.get(attr, {}).get("N", 0))
+
+
+def _item_to_connection(item):
+    return {
+        "connectionId": item["connectionId"]["S"],
+        "role": item.get("role", {}).get("S"),
+        "protocol": _number(item, "protocol") or 1,
+    }
+
+
+def requested_room(event):
+    """Room asked for with ?room= on $connect, or None if the name is invalid."""
+    params = event.get("queryStringParameters") or {}
+    room = params.get("room") or DEFAULT_ROOM
+    return room if ROOM_PATTERN.match(room) else None
+
+
+def remember_room(connection_id, room):
+    if len(_rooms) >= ROOM_CACHE_SIZE:
+        _rooms.clear()
+    _rooms[connection_id] = room
+
+
+def forget_room(connection_id):
+    _rooms.pop(connection_id, None)
+    _roles.pop(connection_id, None)
+
+
+def room_for(event):
+    """Room of the connection behind an event, cached per container.
+
+    The $connect authorizer's context carries it, when there is one.
+    """
+    authorizer = event["requestContext"].get("authorizer") or {}
+    if authorizer.get("room"):
+        return authorizer["room"]
+    connection_id = event["requestContext"]["connectionId"]
+    room = _rooms.get(connection_id)
+    if room is None:
+        resp = dynamodb_client().get_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key=_lookup_key(connection_id),
+            ProjectionExpression="connRoom",
+            ConsistentRead=True,
+        )
+        item = resp.get("Item")
+        # Connections made before rooms existed have no lookup item
+        room = item["connRoom"]["S"] if item else DEFAULT_ROOM
+        remember_room(connection_id, room)
+    return room
+
+
+def get_connection(room, connection_id):
+    """Return {connectionId, role, protocol} for a connection in the room, or None."""
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, connection_id),
+        ProjectionExpression="connectionId, #role, protocol",
+        ExpressionAttributeNames={"#role": "role"},
+    )
+    item = resp.get("Item")
+    return _item_to_connection(item) if item else None
+
+
+def authorizer_role(event):
+    """Role the $connect authorizer put in requestContext.authorizer, if any.
+
+    API Gateway passes the authorizer context to every route of the
+    connection, not only $connect.
+    """
+    authorizer = event["requestContext"].get("authorizer") or {}
+    return authorizer.get("role")
+
+
+def connection_role(event):
+    """Role of the connection behind an event, or None if it is not connected.
+
+    Taken from the authorizer context when there is one. Otherwise it is
+    resolved with one get_connection() per connection and container, then
+    served from the cache for ROLE_CACHE_TTL.
+    """
+    role = authorizer_role(event)
+    if role is not None:
+        return role
+
+    connection_id = event["requestContext"]["connectionId"]
+    now = time.monotonic()
+    cached = _roles.get(connection_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    connection = get_connection(room_for(event), connection_id)
+    if connection is None:
+        return None
+    if len(_roles) >= ROOM_CACHE_SIZE:
+        for key in [key for key, (_, expires_at) in _roles.items() if expires_at <= now]:
+            del _roles[key]
+        if len(_roles) >= ROOM_CACHE_SIZE:
+            _roles.clear()
+    _roles[connection_id] = (connection["role"], now + ROLE_CACHE_TTL)
+    return connection["role"]
+
+
+def _batch_write(requests, required=False):
+    """BatchWriteItem in chunks of 25, retrying unprocessed items with backoff.
+
+    Items still unprocessed after BATCH_WRITE_MAX_ATTEMPTS are logged, or
+    raise RuntimeError when the write is required.
+    """
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        pending = requests[start:start + BATCH_WRITE_SIZE]
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            resp = dynamodb_client().batch_write_item(
+                RequestItems={CONNECTIONS_TABLE_NAME: pending}
+            )
+            pending = resp.get("UnprocessedItems", {}).get(CONNECTIONS_TABLE_NAME, [])
+            if not pending:
+                break
+            time.sleep(0.05 * 2 ** attempt)
+        else:
+            if required:
+                raise RuntimeError(f"BatchWriteItem left {len(pending)} items unprocessed")
+            # Left for the next broadcast to find, or for the item TTL
+            print(json.dumps({"batch_write_unprocessed": len(pending)}))
+
+
+def put_connection(room, connection_id, role, protocol=1, resume=None):
+    """Add a connection to a room, along with its connectionId -> room lookup.
+
+    resume is the (token, expires_at) the connection took over; without one
+    a new token is issued in the same batch. Returns the connection's
+    (token, expires_at). Raises if any of the items could not be written
+    (throttling), so $connect fails and the client connects again instead
+    of staying connected outside the room; an item that did get written is
+    pruned by the next broadcast's GoneException.
+    """
+    now = int(time.time())
+    ttl = {"N": str(now + CONNECTION_TTL_SECONDS)}
+    requests = []
+    if resume is None:
+        resume = (secrets.token_hex(16), now + RESUME_TOKEN_TTL_SECONDS)
+        requests.append({"PutRequest": {"Item": {
+            **_resume_key(resume[0]),
+            "connRoom": {"S": room},
+            "role": {"S": role},
+            "holder": {"S": connection_id},
+            "ttl": {"N": str(resume[1])},
+        }}})
+    _batch_write([
+        {"PutRequest": {"Item": {
+            **_key(room, connection_id),
+            "role": {"S": role},
+            "protocol": {"N": str(protocol)},
+            "resumeToken": {"S": resume[0]},
+            "ttl": ttl,
+        }}},
+        {"PutRequest": {"Item": {
+            **_lookup_key(connection_id),
+            "connRoom": {"S": room},
+            "resumeToken": {"S": resume[0]},
+            "resumeExpiresAt": {"N": str(resume[1])},
+            "ttl": ttl,
+        }}},
+        *requests,
+    ], required=True)
+    return resume
+
+
+def delete_connection(room, connection_id):
+    """Delete a connection; returns what it held, or None if it was already gone.
+
+    The lookup item is left to its TTL: nothing reads it once the
+    connection is gone.
+    """
+    resp = dynamodb_client().delete_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, connection_id),
+        ReturnValues="ALL_OLD",
+    )
+    item = resp.get("Attributes")
+    if item is None:
+        return None
+    return {
+        **_item_to_connection(item),
+        "resumeToken": item.get("resumeToken", {}).get("S"),
+    }
+
+
+def requested_resume_token(event):
+    """Resume token sent with ?resume= on $connect, or None."""
+    params = event.get("queryStringParameters") or {}
+    token = params.get("resume") or ""
+    return token if RESUME_TOKEN_PATTERN.match(token) else None
+
+
+def take_over_resume_token(token, room, connection_id):
+    """Hand a live resume token for this room to a new connection.
+
+    Returns {role, expiresAt, quiet, leftAt}, or None when the token is
+    unknown, expired or for another room. quiet is True when the client came
+    back within RESUME_GRACE_SECONDS of its last disconnect (at leftAt), or
+    while its old connection had not yet disconnected (leftAt is None).
+    """
+    now = time.time()
+    try:
+        resp = dynamodb_client().update_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key=_resume_key(token),
+            UpdateExpression="SET holder = :cid REMOVE leftAt",
+            ConditionExpression="connRoom = :room AND #ttl > :now",
+            ExpressionAttributeNames={"#ttl": "ttl"},
+            ExpressionAttributeValues={
+                ":cid": {"S": connection_id},
+                ":room": {"S": room},
+                ":now": {"N": str(int(now))},
+            },
+            ReturnValues="ALL_OLD",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        raise
+    old = resp["Attributes"]
+    left_at = old.get("leftAt")
+    return {
+        "role": old["role"]["S"],
+        "expiresAt": _number(old, "ttl"),
+        "quiet": left_at is None or now - float(left_at["N"]) <= RESUME_GRACE_SECONDS,
+        "leftAt": float(left_at["N"]) if left_at else None,
+    }
+
+
+def release_resume_token(token, connection_id):
+    """Start the grace window of a disconnecting connection's token.
+
+    False when a newer connection has already taken the token over, i.e.
+    the client is still here.
+    """
+    try:
+        dynamodb_client().update_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key=_resume_key(token),
+            UpdateExpression="SET leftAt = :now",
+            ConditionExpression="holder = :cid",
+            ExpressionAttributeValues={
+                ":now": {"N": str(time.time())},
+                ":cid": {"S": connection_id},
+            },
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+def note_departure_check(room):
+    """Record that a departure broadcast is about to read the room's count."""
+    dynamodb_client().update_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        UpdateExpression="SET departureCheckedAt = :now",
+        ExpressionAttributeValues={":now": {"N": str(time.time())}},
+    )
+
+
+def counted_as_departed(room, left_at):
+    """True when a departure broadcast may have told the room a client that left at left_at was gone.
+
+    Another connection's grace window can close while this client is still
+    inside its own, and that broadcast counts it out. Call this after the
+    resumed connection is counted again: a check that runs later sees it.
+    """
+    if left_at is None:
+        return False
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        ProjectionExpression="departureCheckedAt",
+        ConsistentRead=True,
+    )
+    checked_at = resp.get("Item", {}).get("departureCheckedAt")
+    return checked_at is not None and float(checked_at["N"]) > left_at
+
+
+def get_resume_token(connection_id):
+    """Return the (token, expires_at) of a connection, or None.
+
+    Read from the lookup item, which outlives the connection item.
+    """
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_lookup_key(connection_id),
+        ProjectionExpression="resumeToken, resumeExpiresAt",
+        ConsistentRead=True,
+    )
+    item = resp.get("Item", {})
+    if "resumeToken" not in item:
+        return None
+    return item["resumeToken"]["S"], _number(item, "resumeExpiresAt")
+
+
+def _query_room(room, **kwargs):
+    """Yield each page of a room query, following LastEvaluatedKey."""
+    kwargs.update(
+        TableName=CONNECTIONS_TABLE_NAME,
+        KeyConditionExpression="room = :r",
+        FilterExpression="connectionId <> :meta",
+        ExpressionAttributeValues={
+            ":r": {"S": room},
+            ":meta": {"S": META_CONNECTION_ID},
+        },
+    )
+    while True:
+        page = dynamodb_client().query(**kwargs)
+        yield page
+        last_key = page.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def _membership(room):
+    return _memberships.setdefault(room, {"members": None, "version": None, "checked_at": 0.0})
+
+
+def _get_room_version(room):
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        ProjectionExpression="version",
+    )
+    return _number(resp.get("Item", {}), "version")
+
+
+def _bump_room_version(room, added=None, removed=(), count_delta=0, reconcile=False):
+    """Tell other containers the room changed, and patch our cached copy.
+
+    Local changes are always safe to apply, but the cache only counts as
+    current when it was exactly one version behind; otherwise someone else
+    changed the room too and the next iter_connections() reloads it.
+    reconcile=True makes the next count read recount the room.
+    Returns the updated META item.
+    """
+    update = "ADD version :one, viewerCount :delta"
+    if reconcile:
+        update += " REMOVE reconciledAt"
+    resp = dynamodb_client().update_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        UpdateExpression=update,
+        ExpressionAttributeValues={
+            ":one": {"N": "1"},
+            ":delta": {"N": str(count_delta)},
+        },
+        ReturnValues="ALL_NEW",
+    )
+    meta = resp["Attributes"]
+    version = _number(meta, "version")
+    membership = _membership(room)
+    members = membership["members"]
+    if members is not None:
+        members.update(added or {})
+        for connection_id in removed:
+            members.pop(connection_id, None)
+        if membership["version"] == version - 1:
+            membership["version"] = version
+    return meta
+
+
+def _reconcile_viewer_count(room, meta):
+    """Overwrite the counter with a real COUNT of the room.
+
+    Catches drift from TTL-expired connections and from prunes racing a
+    $disconnect. The recount is claimed first with a conditional write of
+    reconciledAt, so only one caller per interval (or per prune) runs the
+    COUNT query; everyone else returns the counter in meta.
+    """
+    now = int(time.time())
+    try:
+        dynamodb_client().update_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key=_key(room, META_CONNECTION_ID),
+            UpdateExpression="SET reconciledAt = :now",
+            ConditionExpression="attribute_not_exists(reconciledAt) OR reconciledAt <= :due",
+            ExpressionAttributeValues={
+                ":now": {"N": str(now)},
+                ":due": {"N": str(now - VIEWER_COUNT_RECONCILE_SECONDS)},
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return max(0, _number(meta, "viewerCount"))
+        raise
+    count = count_connections(room)
+    dynamodb_client().update_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        UpdateExpression="SET viewerCount = :c",
+        ExpressionAttributeValues={":c": {"N": str(count)}},
+    )
+    return count
+
+
+def _viewer_count_from_meta(room, meta):
+    if time.time() - _number(meta, "reconciledAt") >= VIEWER_COUNT_RECONCILE_SECONDS:
+        return _reconcile_viewer_count(room, meta)
+    return max(0, _number(meta, "viewerCount"))
+
+
+def get_viewer_count(room):
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        ProjectionExpression="viewerCount, reconciledAt",
+    )
+    return _viewer_count_from_meta(room, resp.get("Item", {}))
+
+
+def note_connected(room, connection_id, role, protocol=1):
+    """Record a new connection and return the room's updated viewer count."""
+    connection = {"connectionId": connection_id, "role": role, "protocol": protocol}
+    meta = _bump_room_version(room, added={connection_id: connection}, count_delta=1)
+    return _viewer_count_from_meta(room, meta)
+
+
+def note_disconnected(room, connection_id):
+    """Record a removed connection and return the room's updated viewer count."""
+    meta = _bump_room_version(room, removed=[connection_id], count_delta=-1)
+    return _viewer_count_from_meta(room, meta)
+
+
+def iter_connections(room):
+    """Yield the room's connections as {connectionId, role, protocol} items.
+
+    Served from the container cache while it is younger than
+    CONNECTION_CACHE_TTL or the room version is unchanged; otherwise the room
+    is re-queried and streamed page by page while the cache is rebuilt.
+    """
+    now = time.monotonic()
+    membership = _membership(room)
+    members = membership["members"]
+    if members is not None and now - membership["checked_at"] < CONNECTION_CACHE_TTL:
+        yield from list(members.values())
+        return
+
+    # Read the version before the query so a concurrent change is never masked
+    version = _get_room_version(room)
+    if members is not None and version == membership["version"]:
+        membership["checked_at"] = now
+        yield from list(members.values())
+        return
+
+    loaded = {}
+    for page in _query_room(
+        room,
+        ProjectionExpression="connectionId, #role, protocol",
+        ExpressionAttributeNames={"#role": "role"},
+    ):
+        for item in page.get("Items", []):
+            connection = _item_to_connection(item)
+            loaded[connection["connectionId"]] = connection
+            yield connection
+    membership.update(members=loaded, version=version, checked_at=now)
+
+
+def count_connections(room):
+    return sum(page.get("Count", 0) for page in _query_room(room, Select="COUNT"))
+
+
+def delete_connections(room, connection_ids):
+    """Delete connections from a room 25 at a time."""
+    _batch_write([
+        {"DeleteRequest": {"Key": _key(room, connection_id)}}
+        for connection_id in connection_ids
+    ])
+
+
+def note_pruned(room, connection_ids):
+    """Record connections that answered GoneException.
+
+    BatchWriteItem cannot tell which items still existed ($disconnect may
+    have removed and counted some already), so instead of decrementing the
+    counter the next count read recounts the room.
+    """
+    _bump_room_version(room, removed=connection_ids, reconcile=True)
+
+
+def save_slide_state(room, state):
+    """Keep the presenter's latest slide sync on the room's META; returns its seq."""
+    resp = dynamodb_client().update_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        UpdateExpression="SET slideState = :state ADD slideSeq :one",
+        ExpressionAttributeValues={
+            ":state": {"S": state},
+            ":one": {"N": "1"},
+        },
+        ReturnValues="UPDATED_NEW",
+    )
+    return _number(resp["Attributes"], "slideSeq")
+
+
+def get_slide_seq(room):
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        ProjectionExpression="slideSeq",
+    )
+    return _number(resp.get("Item", {}), "slideSeq")
+
+
+def get_slide_state(room):
+    """Return (slide sync message, seq) last saved for the room, or (None, 0)."""
+    resp = dynamodb_client().get_item(
+        TableName=CONNECTIONS_TABLE_NAME,
+        Key=_key(room, META_CONNECTION_ID),
+        ProjectionExpression="slideState, slideSeq",
+    )
+    item = resp.get("Item", {})
+    return item.get("slideState", {}).get("S"), _number(item, "slideSeq")
+
+
+def claim_window(room, attr, window_ms):
+    """Single-flight marker on the room's META: True for the one caller per window."""
+    now_ms = int(time.time() * 1000)
+    try:
+        dynamodb_client().update_item(
+            TableName=CONNECTIONS_TABLE_NAME,
+            Key=_key(room, META_CONNECTION_ID),
+            UpdateExpression="SET #at = :now",
+            ConditionExpression="attribute_not_exists(#at) OR #at <= :due",
+            ExpressionAttributeNames={"#at": attr},
+            ExpressionAttributeValues={
+                ":now": {"N": str(now_ms)},
+                ":due": {"N": str(now_ms - window_ms)},
+            },
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
@@ -0,0 +1,87 @@
+import json
+import os
+import uuid
+
+from wscore.aws import sqs_client
+
+# Broadcasts to more than FANOUT_THRESHOLD connections are split into chunks
+# of FANOUT_CHUNK_SIZE and queued for the fanout Lambda instead of being sent
+# by the invocation that produced them. Unset FANOUT_QUEUE_URL disables this;
+# "local" sends each chunk in-process, for running without AWS.
+FANOUT_QUEUE_URL = os.environ.get("FANOUT_QUEUE_URL", "")
+FANOUT_THRESHOLD = int(os.environ.get("FANOUT_THRESHOLD", "500"))
+FANOUT_CHUNK_SIZE = int(os.environ.get("FANOUT_CHUNK_SIZE", "200"))
+
+SEND_BATCH_SIZE = 10  # SendMessageBatch limit
+SEND_BATCH_MAX_BYTES = 200 * 1024  # below the 256 KiB per-batch limit
+
+
+class LocalQueue:
+    """Stand-in for the SQS client that hands each chunk straight to handle_chunk()."""
+
+    def send_message_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            handle_chunk(json.loads(entry["MessageBody"]))
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+
+_local_queue = LocalQueue()
+
+
+def _queue():
+    return _local_queue if FANOUT_QUEUE_URL == "local" else sqs_client()
+
+
+def should_fan_out(recipients):
+    return bool(FANOUT_QUEUE_URL) and recipients > FANOUT_THRESHOLD
+
+
+def _send_batch(entries):
+    resp = _queue().send_message_batch(QueueUrl=FANOUT_QUEUE_URL, Entries=entries)
+    failed = resp.get("Failed", [])
+    if failed:
+        raise RuntimeError(f"Failed to enqueue {len(failed)} fan-out chunks: {failed[0].get('Message')}")
+
+
+def enqueue(event, room, targets, payloads):
+    """Queue targets, a list of [connectionId, payload index], in chunks.
+
+    Every chunk carries the endpoint and the (at most two) encoded payloads,
+    so the fanout Lambda needs nothing else to send it. Returns the number
+    of chunks queued.
+    """
+    context = event["requestContext"]
+    chunks = 0
+    entries = []
+    batch_bytes = 0
+    for start in range(0, len(targets), FANOUT_CHUNK_SIZE):
+        body = json.dumps({
+            "domainName": context["domainName"],
+            "stage": context["stage"],
+            "room": room,
+            "payloads": [data.decode("utf-8") for data in payloads],
+            "targets": targets[start:start + FANOUT_CHUNK_SIZE],
+        }, separators=(",", ":"))
+        if entries and (len(entries) == SEND_BATCH_SIZE or batch_bytes + len(body) > SEND_BATCH_MAX_BYTES):
+            _send_batch(entries)
+            entries, batch_bytes = [], 0
+        entries.append({"Id": uuid.uuid4().hex, "MessageBody": body})
+        batch_bytes += len(body)
+        chunks += 1
+    if entries:
+        _send_batch(entries)
+    return chunks
+
+
+def handle_chunk(chunk):
+    """Send one queued chunk; GoneException connections are pruned as one batch."""
+    # Imported here because wscore.broadcast imports this module
+    from wscore.broadcast import deliver
+
+    event = {"requestContext": {"domainName": chunk["domainName"], "stage": chunk["stage"]}}
+    payloads = [payload.encode("utf-8") for payload in chunk["payloads"]]
+    return deliver(
+        event,
+        chunk["room"],
+        [(connection_id, payloads[index]) for connection_id, index in chunk["targets"]],
+    )
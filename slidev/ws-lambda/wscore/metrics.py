@@ -0,0 +1,169 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+# Per-invocation metrics for every handler. "emf" prints one CloudWatch
+# Embedded Metric Format record per invocation, which the Lambda log agent
+# turns into metrics; "local" prints a one-line summary instead (tests,
+# benchmarks); "off" skips collection entirely.
+#
+# This module imports nothing from wscore so the login Lambda can ship it
+# on its own.
+METRICS_MODE = os.environ.get("METRICS_MODE", "emf")
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "slidev-hosting")
+
+# DynamoDB operations that accept ReturnConsumedCapacity
+CAPACITY_OPERATIONS = {
+    "GetItem", "PutItem", "UpdateItem", "DeleteItem", "Query", "Scan",
+    "BatchGetItem", "BatchWriteItem", "TransactWriteItems", "TransactGetItems",
+}
+CALL_METRICS = {
+    "dynamodb": "DynamoDBCalls",
+    "apigatewaymanagementapi": "PostToConnectionCalls",
+    "sqs": "SQSCalls",
+    "secretsmanager": "SecretsManagerCalls",
+}
+CONDITION_ERRORS = {"ConditionalCheckFailedException", "TransactionCanceledException"}
+THROTTLE_ERRORS = {
+    "ProvisionedThroughputExceededException", "RequestLimitExceeded",
+    "ThrottlingException", "LimitExceededException",
+}
+
+
+class _Invocation:
+    def __init__(self, function):
+        self.function = function
+        self.route = function
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.values = Counter()
+        self.units = {}
+
+
+# A Lambda container runs one invocation at a time; worker threads of the
+# broadcast pool report into it too
+_current = None
+
+
+def instrument_client(client):
+    """Count calls, error codes, retries and DynamoDB consumed capacity of a botocore client."""
+    if METRICS_MODE == "off":
+        return client
+    service = client.meta.service_model.service_id.hyphenize()
+    if service == "dynamodb":
+        client.meta.events.register("before-parameter-build.dynamodb", _request_capacity)
+    client.meta.events.register(f"after-call.{service}", _after_call)
+    return client
+
+
+def _request_capacity(params, model, **kwargs):
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _after_call(parsed, model, **kwargs):
+    invocation = _current
+    if invocation is None:
+        return
+    service = model.service_model.service_name
+    code = parsed.get("Error", {}).get("Code")
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    capacity = parsed.get("ConsumedCapacity") or []
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    with invocation.lock:
+        invocation.calls[f"{service}.{model.name}"] += 1
+        invocation.values[CALL_METRICS.get(service, "OtherCalls")] += 1
+        invocation.values["RetryAttempts"] += retries
+        invocation.values["DynamoDBConsumedCapacity"] += sum(c.get("CapacityUnits", 0) for c in capacity)
+        if code:
+            invocation.errors[code] += 1
+
+
+def add(name, value, unit="Count"):
+    """Add value to a metric of the current invocation."""
+    invocation = _current
+    if invocation is None:
+        return
+    with invocation.lock:
+        invocation.values[name] += value
+        invocation.units[name] = unit
+
+
+def set_route(route):
+    """Name the route of the current invocation (the Route dimension)."""
+    if _current is not None:
+        _current.route = route
+
+
+def record_broadcast(stats):
+    add("Broadcasts", 1)
+    add("BroadcastRecipients", stats["recipients"])
+    for key, name in (("stale", "BroadcastStale"), ("failed", "BroadcastFailed"), ("skipped", "BroadcastSkipped")):
+        add(name, stats.get(key, 0))
+    add("BroadcastMs", stats["total_ms"], "Milliseconds")
+    if stats["recipients"]:
+        add("BroadcastMsPerRecipient", stats["total_ms"] / stats["recipients"], "Milliseconds")
+
+
+def _emit(invocation):
+    values = dict(invocation.values)
+    units = dict(invocation.units)
+    values["Duration"] = round((time.perf_counter() - invocation.started) * 1000, 1)
+    units["Duration"] = "Milliseconds"
+    values["GoneExceptions"] = invocation.errors["GoneException"]
+    values["ConditionalCheckFailures"] = sum(invocation.errors[code] for code in CONDITION_ERRORS)
+    values["Throttles"] = sum(invocation.errors[code] for code in THROTTLE_ERRORS)
+
+    if METRICS_MODE == "local":
+        summary = " ".join(f"{name}={value:g}" for name, value in sorted(values.items()) if value or name == "Duration")
+        calls = " ".join(f"{name}={count}" for name, count in sorted(invocation.calls.items()))
+        print(f"[metrics] {invocation.function}/{invocation.route} {summary} | {calls}")
+        return
+
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Function", "Route"]],
+                "Metrics": [
+                    {"Name": name, "Unit": units.get(name, "Count")} for name in values
+                ],
+            }],
+        },
+        "Function": invocation.function,
+        "Route": invocation.route,
+        **values,
+        "calls": dict(invocation.calls),
+        "errors": dict(invocation.errors),
+    }))
+
+
+def instrument(function):
+    """Decorator for a Lambda handler: collect its invocation's metrics and emit them."""
+    def decorator(handler):
+        if METRICS_MODE == "off":
+            return handler
+
+        @functools.wraps(handler)
+        def wrapped(event, context):
+            global _current
+            invocation = _current = _Invocation(function)
+            try:
+                return handler(event, context)
+            except Exception:
+                add("HandlerErrors", 1)
+                raise
+            finally:
+                _current = None
+                _emit(invocation)
+
+        return wrapped
+
+    return decorator
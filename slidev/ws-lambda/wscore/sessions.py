@@ -0,0 +1,74 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+from wscore.aws import SESSION_TABLE_NAME, dynamodb_client
+from wscore.connections import DEFAULT_ROOM
+
+COOKIE_NAME = "slide_auth"
+
+# token -> (room or None, expires_at), least recently used first. A revoked
+# session keeps working for up to SESSION_CACHE_TTL in a container that
+# already saw it.
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_SIZE = 1024
+_sessions = OrderedDict()
+
+
+def get_session_token(event):
+    headers = event.get("headers") or {}
+    cookie_header = headers.get("cookie") or headers.get("Cookie") or ""
+    for part in cookie_header.split(";"):
+        part = part.strip()
+        if part.startswith(f"{COOKIE_NAME}="):
+            return part.split("=", 1)[1]
+    return None
+
+
+def _session_room(token):
+    """Room of a valid presenter session, or None.
+
+    Sessions issued before rooms existed carry no room and count for the
+    default room only.
+    """
+    response = dynamodb_client().get_item(
+        TableName=SESSION_TABLE_NAME,
+        Key={"token": {"S": token}},
+        ProjectionExpression="#status, room",
+        ExpressionAttributeNames={"#status": "status"},
+    )
+    item = response.get("Item")
+    if item is None or item.get("status", {}).get("S") != "valid":
+        return None
+    return item.get("room", {}).get("S", DEFAULT_ROOM)
+
+
+def verify_session(token, room):
+    """True if the token is a valid presenter session for this room.
+
+    No token means a viewer and costs nothing. Lookups are cached per
+    container, valid or not. A failed lookup counts as a viewer and is
+    not cached.
+    """
+    if not token:
+        return False
+    now = time.monotonic()
+    cached = _sessions.get(token)
+    if cached and cached[1] > now:
+        _sessions.move_to_end(token)
+        return cached[0] == room
+
+    try:
+        session_room = _session_room(token)
+    except ClientError as e:
+        print(json.dumps({"session_lookup_failed": e.response["Error"]["Code"]}))
+        return False
+    _sessions[token] = (session_room, now + SESSION_CACHE_TTL)
+    _sessions.move_to_end(token)
+    while len(_sessions) > SESSION_CACHE_SIZE:
+        _sessions.popitem(last=False)
+    return session_room == room
+